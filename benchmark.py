@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+"""
+Scan performance benchmark. Builds a reproducible synthetic document tree in a scratch
+directory, points ddms at it and times:
+ - a cold scan (empty database)
+ - a warm rescan (nothing changed)
+ - a rescan after a percentage of the files were moved, modified or deleted
+plus get_hash on its own. Results are printed as JSON, so runs can be compared across
+releases, e.g.:   python benchmark.py --files 20000 --output bench.json
+
+Previews are not generated - the preview pipeline is never started, so this measures
+the scan and database work only.
+"""
+
+import math
+import tempfile
+import contextlib
+
+from imports import *     # need these in root namespace
+from constants import *   # root namespace
+from sqlalchemy import event
+
+import ddms
+
+
+def generate_tree(root, files, depth, fanout, mean_size, seed):
+    """
+    Make a tree of `files` files spread over directories up to `depth` levels deep, at most
+    `fanout` subdirectories each. File sizes follow a log-normal distribution around
+    mean_size - lots of small documents and a few big ones. The same seed gives the same tree.
+    """
+    rng = random.Random(seed)
+    directories = [Path('')]
+    frontier = [Path('')]
+    for level in range(depth):
+        next_frontier = list()
+        for parent in frontier:
+            for number in range(rng.randint(1, fanout)):
+                child = parent.joinpath(f'dir-{level}-{number}')
+                root.joinpath(child).mkdir()
+                directories.append(child)
+                next_frontier.append(child)
+        frontier = next_frontier
+
+    total_bytes = 0
+    sigma = 1.0
+    mu = math.log(mean_size) - sigma * sigma / 2  # so the mean comes out at mean_size
+    for number in range(files):
+        size = max(1, int(rng.lognormvariate(mu, sigma)))
+        pathname = root.joinpath(rng.choice(directories), f'file-{number}.dat')
+        pathname.write_bytes(rng.getrandbits(8 * size).to_bytes(size, 'little'))
+        total_bytes += size
+    return total_bytes
+
+
+def mutate_tree(root, percent, seed):
+    """move, modify and delete (a third each) of `percent` percent of the files"""
+    rng = random.Random(seed + 1)
+    pathnames = sorted(path for path in root.rglob('*.dat'))
+    directories = sorted({path.parent for path in pathnames})
+    chosen = rng.sample(pathnames, int(len(pathnames) * percent / 100))
+    counts = dict(moved=0, modified=0, deleted=0)
+    for index, pathname in enumerate(chosen):
+        kind = ('moved', 'modified', 'deleted')[index % 3]
+        if kind == 'moved':
+            pathname.rename(rng.choice(directories).joinpath('moved-' + pathname.name))
+        elif kind == 'modified':
+            with pathname.open('ab') as file:
+                file.write(b'modified')
+        else:
+            pathname.unlink()
+        counts[kind] += 1
+    return counts
+
+
+def reset_peak_rss():
+    """
+    start measuring a phase's own peak resident set size - Linux lets the high water mark be
+    reset through /proc. Returns False where it can't be, see rss_figures.
+    """
+    try:
+        Path('/proc/self/clear_refs').write_text('5')
+        return True
+    except OSError:
+        return False
+
+
+def rss_figures(reset):
+    """
+    the memory figures for a phase, in MB. peak_rss_mb is this process's peak since
+    reset_peak_rss and is left out when that couldn't reset it. peak_rss_mb_cumulative is
+    the peak of this process and its (hashing) children since the benchmark started, so it
+    never goes down from one phase to the next - left out where there's no resource module
+    (Windows).
+    """
+    figures = dict()
+    if resource is not None:
+        # ru_maxrss is KB on Linux, bytes on macOS
+        scale = 1024 * 1024 if sys.platform == 'darwin' else 1024
+        own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+        figures['peak_rss_mb_cumulative'] = round(max(own, children) / scale, 1)
+    if reset:
+        for line in Path('/proc/self/status').read_text().splitlines():
+            if line.startswith('VmHWM:'):  # in kB
+                figures['peak_rss_mb'] = round(int(line.split()[1]) / 1024, 1)
+    return figures
+
+
+def tree_totals(root):
+    """number of files and bytes currently in the tree"""
+    files = 0
+    total_bytes = 0
+    for pathname in root.rglob('*.dat'):
+        files += 1
+        total_bytes += pathname.stat().st_size
+    return files, total_bytes
+
+
+def run_scan(name, root, args):
+    """one startup's worth of work: load the database snapshot, then the initial scan"""
+    statements = [0]
+
+    def count_statement(*_):
+        statements[0] += 1
+
+    reset = reset_peak_rss()
+    started = time.perf_counter()
+    # the scan prints deleted paths, keep those out of the JSON on stdout
+    with contextlib.redirect_stdout(sys.stderr):
+        ddms.GLOBAL_DATA = ddms.GlobalData()
+        event.listen(ddms.GLOBAL_DATA.db_engine, 'before_cursor_execute', count_statement)
+        ddms.initial_file_scan(args.hash_workers, args.hash_pool, False, args.batch_size)
+    elapsed = time.perf_counter() - started
+    ddms.GLOBAL_DATA.db_conn.close()
+    ddms.GLOBAL_DATA.db_engine.dispose()
+    ddms.GLOBAL_DATA.read_engine.dispose()
+
+    files, total_bytes = tree_totals(root)
+    return {
+        'phase': name,
+        'seconds': round(elapsed, 3),
+        'files': files,
+        'files_per_second': round(files / elapsed, 1),
+        'mb_per_second': round(total_bytes / elapsed / 1e6, 2),
+        'db_statements': statements[0],
+        **rss_figures(reset),
+    }
+
+
+def run_hash(root):
+    """get_hash alone over every file in the tree, on this thread"""
+    pathnames = list(root.rglob('*.dat'))
+    total_bytes = sum(pathname.stat().st_size for pathname in pathnames)
+    reset = reset_peak_rss()
+    started = time.perf_counter()
+    for pathname in pathnames:
+        ddms.get_hash(pathname)
+    elapsed = time.perf_counter() - started
+    return {
+        'phase': 'get_hash',
+        'seconds': round(elapsed, 3),
+        'files': len(pathnames),
+        'files_per_second': round(len(pathnames) / elapsed, 1),
+        'mb_per_second': round(total_bytes / elapsed / 1e6, 2),
+        **rss_figures(reset),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='benchmark the ddms initial scan')
+    parser.add_argument('--files', type=int, default=5000, help='number of files in the tree')
+    parser.add_argument('--depth', type=int, default=4, help='directory levels')
+    parser.add_argument('--fanout', type=int, default=4, help='most subdirectories per directory')
+    parser.add_argument('--mean-size', type=int, default=64 * 1024, help='mean file size, bytes')
+    parser.add_argument('--change-percent', type=float, default=10,
+                        help='percent of files moved, modified or deleted before the last scan')
+    parser.add_argument('--seed', type=int, default=1, help='random seed for the tree')
+    parser.add_argument('--hash-workers', type=int, default=HASH_WORKERS)
+    parser.add_argument('--hash-pool', choices=['process', 'thread'], default=HASH_POOL_TYPE)
+    parser.add_argument('--batch-size', type=int, default=INGEST_BATCH_SIZE)
+    parser.add_argument('--keep', action='store_true', help='keep the scratch directory')
+    parser.add_argument('--output', help='write the JSON report here instead of stdout')
+    args = parser.parse_args()
+
+    LOG.setLevel('WARNING')
+    scratch = Path(tempfile.mkdtemp(prefix='ddms-bench-'))
+    root = scratch.joinpath('root')
+    root.mkdir()
+    # point ddms at the scratch tree and database
+    ddms.ROOT_DIRECTORY = root
+    ddms.DATABASE_PATH = scratch.joinpath('data.sqlite')
+    ddms.THUMBNAIL_DIRECTORY = root.joinpath('.thumbnails')
+
+    try:
+        total_bytes = generate_tree(root, args.files, args.depth, args.fanout,
+                                    args.mean_size, args.seed)
+        report = {
+            'database_version': ddms.DATABASE_VERSION,
+            'settings': {key: value for key, value in vars(args).items()
+                         if key not in ('keep', 'output')},
+            'tree_mb': round(total_bytes / 1e6, 2),
+            'results': list(),
+        }
+        report['results'].append(run_scan('cold', root, args))
+        report['results'].append(run_scan('warm', root, args))
+        report['mutations'] = mutate_tree(root, args.change_percent, args.seed)
+        report['results'].append(run_scan('changed', root, args))
+        report['results'].append(run_hash(root))
+    finally:
+        os.chdir(str(scratch.parent))
+        if not args.keep:
+            rmtree(str(scratch))
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        Path(args.output).write_text(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -15,10 +15,67 @@ else:
 
 THUMBNAIL_DIRECTORY = ROOT_DIRECTORY.joinpath('.thumbnails')
 
+# version of the database layout this code expects, see update-db.py
+DATABASE_VERSION = 8
+
 EXCLUDE_EXTENSIONS = ['sqlite']
 IGNORED_DIRECTORIES = [Path('.thumbnails')]
 
+# Initial scan hashing: the directory walk stays on the main thread and the file
+# hashing is handed to a pool of workers. HASH_POOL_TYPE is 'process' or 'thread',
+# HASH_WORKERS of None means one worker per CPU, 0 hashes serially on the main thread.
+HASH_POOL_TYPE = 'process'
+HASH_WORKERS = None
+HASH_CHUNK_SIZE = 1024 * 1024  # bytes read and hashed at a time
+FINGERPRINT_BLOCK_SIZE = 4096  # bytes taken from each end of a file for its fingerprint
+
+# Initial scan database writes are committed in batches: a transaction every
+# INGEST_BATCH_SIZE files or INGEST_BATCH_MS milliseconds, whichever comes first.
+INGEST_BATCH_SIZE = 500
+INGEST_BATCH_MS = 2000
+# how often the initial scan records how far it has got, so it can resume if interrupted
+SCAN_CHECKPOINT_SECONDS = 30
+
+# number of background threads generating previews
+PREVIEW_WORKERS = 2
+# each runs in its own process: a preview taking longer than this many seconds gets the
+# process killed and restarted, and the process may use at most this much memory (bytes)
+PREVIEW_TIMEOUT = 120
+PREVIEW_MEMORY_LIMIT = 4 * 1024 * 1024 * 1024
+# Thumbnail files no item refers to are cleaned up in the background, a little at a time:
+# every THUMBNAIL_GC_INTERVAL seconds (while otherwise idle) look at THUMBNAIL_GC_BATCH
+# files and remove at most THUMBNAIL_GC_DELETES. Files younger than THUMBNAIL_GC_MIN_AGE
+# seconds are left alone, they may be about to be recorded. A full pass runs every
+# THUMBNAIL_GC_PERIOD seconds.
+THUMBNAIL_GC_BATCH = 200
+THUMBNAIL_GC_DELETES = 50
+THUMBNAIL_GC_INTERVAL = 1.0
+THUMBNAIL_GC_MIN_AGE = 3600
+THUMBNAIL_GC_PERIOD = 24 * 3600
+# Previews are rendered once at the largest size; the others are scaled down from that
+# on demand (see serve_thumb) and kept next to it. Search results use the default size.
+THUMBNAIL_SIZES = (64, 200, 800)
+THUMBNAIL_DEFAULT_SIZE = 200
+THUMBNAIL_FORMAT = 'webp'  # falls back to progressive jpeg if Pillow has no webp support
+# searches whose pages can still fetch their previews, the most recent ones
+SEARCHES_KEPT = 20
+
+# filesystem monitor events for a path are held this many seconds after the last one,
+# so a burst of them (create, 12 modifies...) is applied as one net change
+FILESYSTEM_EVENT_DELAY = 15
+# due changes are applied this many to a transaction, checking for web UI queries in between
+FILESYSTEM_EVENT_BATCH = 100
+# Event storms (unpacking an archive, a sync catching up): a directory subtree getting more
+# than STORM_EVENTS events within STORM_WINDOW seconds stops being handled event by event -
+# it gets one rescan, once it has been quiet for FILESYSTEM_EVENT_DELAY seconds.
+STORM_EVENTS = 500
+STORM_WINDOW = 10
+# most entries the work queue holds, the filesystem monitor waits when it's full
+QUEUE_MAX_SIZE = 10000
+
 NETWORK_PORT = 8080
+# read-only database connections shared by the web UI threads
+READ_POOL_SIZE = 4
 BROWSE_LIST_INCLUDE_FILES = False
 
 # THINGS CONFIGURED TO SUPPORT DEVELOPMENT
@@ -28,3 +85,5 @@ logging.basicConfig(format=LOGGING_FORMAT)
 LOG = logging.getLogger('DDMS')
 LOG.setLevel('INFO')
 LOG.addHandler(logging.FileHandler(SCRIPT_DIR.joinpath(LOG_FILE)))
+# most web UI edits committed together in one transaction
+EDIT_GROUP_SIZE = 200
@@ -22,12 +22,10 @@ bottle_debug(mode=True)
 
 
 # This will be a work queue for items from file system
-# monitoring and web server which run in other threads.
-QUEUE = queue.Queue()
+# monitoring and web server which run in other threads. Bounded, so an event storm
+# can't run away with the memory.
+QUEUE = queue.Queue(maxsize=QUEUE_MAX_SIZE)
 
-# This is for the main thread to return results to the
-# GUI thread.
-RESULTSQ = queue.Queue()
 
 
 
@@ -35,14 +33,20 @@ class DDMSException(Exception):
     """basic custom exception"""
 
 
+# what the scan's snapshot (see load_snapshot) holds for each path in the database
+SnapshotEntry = namedtuple('SnapshotEntry', 'size mtime_ns inode fingerprint shahash')
+
+
 class ItemEntry:
     """in memory item object"""
 
-    def __init__(self, pathname, shahash, thumbnail, labels=''):
+    def __init__(self, pathname, shahash, thumbnail, labels='', stat=None, fingerprint=None):
         self.shahash = shahash
         self.pathname = pathname
         self.thumbnail = thumbnail
         self.labels = labels
+        self.stat = stat  # (size, mtime_ns, inode) when the hash was taken
+        self.fingerprint = fingerprint
 
 
     def set_preview(self, preview):
@@ -82,6 +86,11 @@ class DDMSFilesystemEventHandler(FileSystemEventHandler):
 
     def on_any_event(self, event):
         # pylint: disable=misplaced-comparison-constant
+        # whole directories moving or going away are handled in bulk
+        if 'moved' == event.event_type and event.is_directory:
+            self.directory_moved_from_event(event)
+        if 'deleted' == event.event_type and event.is_directory:
+            self.directory_deleted_from_event(event)
         if 'created' == event.event_type and not event.is_directory:
             self.add_item_from_event(event)
         if 'moved' == event.event_type and not event.is_directory:
@@ -129,6 +138,26 @@ class DDMSFilesystemEventHandler(FileSystemEventHandler):
             # LOG.info(log_message)
 
 
+    def directory_moved_from_event(self, event):
+        """triggered by a file system event, a directory is moved, update everything in it"""
+        src = make_path_relative(event.src_path)
+        dest = make_path_relative(event.dest_path)
+        if src and dest is None:
+            return  # into an ignored directory - leave it to the per-file events
+        if src and os.path.isabs(dest):
+            # moved out from under the root directory, as good as gone
+            QUEUE.put({"type": "filesystem-monitor", "action": "dir-delete", "src": src})
+        elif src:
+            QUEUE.put({"type": "filesystem-monitor", "action": "dir-moved", "src": src, "dest": dest})
+
+
+    def directory_deleted_from_event(self, event):
+        """triggered by a file system event, a directory is deleted, delete everything in it"""
+        src = make_path_relative(event.src_path)
+        if src:
+            QUEUE.put({"type": "filesystem-monitor", "action": "dir-delete", "src": src})
+
+
 class BLPathTreeNode:
     """For a nodee of the browse list tree. object is the node in directory tree for browse list"""
 
@@ -183,10 +212,10 @@ class BLPathTreeNode:
             child.delete_tree()
             del child
 
-    def create_path(self, path_parts):
+    def create_path(self, path_parts, root):
         """Prove a given path exists or create it, all the while finding the tree
-        node at the bottom"""
-        cp_node = GLOBAL_DATA.browse_list_object
+        node at the bottom - starting from the root of the tree being built"""
+        cp_node = root
         creating = False
         for pindex in range(len(path_parts)-1): # stop one short of filename (last element)
             if not creating:
@@ -207,7 +236,7 @@ class BLPathTreeNode:
         return cp_node
 
 
-def bl_output_directories_structure():
+def bl_output_directories_structure(directories):
     """
     Used to output json structure for browse list from just a list of directories instead of the
     above tree.
@@ -220,7 +249,7 @@ def bl_output_directories_structure():
     output_string = ''
     parents_stack = list()
 
-    for dire in GLOBAL_DATA.browse_list_object:
+    for dire in directories:
         path = Path(dire)
         path_parts = list(path.parts)
         path_len = len(path_parts)
@@ -286,6 +315,12 @@ def bl_output_directories_structure():
     #  }
 
 
+# item_labels rows go when their item does - however the item is deleted (one at a time,
+# a directory at once, moved over). The same trigger is made by update-db.py.
+ITEM_LABELS_TRIGGER = "CREATE TRIGGER IF NOT EXISTS item_labels_delete AFTER DELETE ON items " \
+                      "BEGIN DELETE FROM item_labels WHERE item_id = old.id; END;"
+
+
 class GlobalData:
     """
     Holds various global values, pointers to services and database information
@@ -295,23 +330,7 @@ class GlobalData:
     def __init__(self):
         """initialize this class"""
 
-        # startup preview generator - this guy wants to emit useless messages
-        # when starting, tried to throw away with assignmet to os.devnull. That
-        # was broken, it wants to see a real file. So, try a temporary file.
-        # THIS is DANGEROUS - you can miss a real error.
-        save_stdout = sys.stdout
-        tempfile = TemporaryFile(mode='w', suffix='txt')
-        sys.stdout = tempfile
-        try:
-            self.preview = PreviewManager(THUMBNAIL_DIRECTORY, create_folder=True)
-
-        # pylint bare-except
-        except Exception as exception_info:
-            LOG.error('Exception in Preview Generator startup')
-            LOG.error(exception_info)
-
-        sys.stdout.close()
-        sys.stdout = save_stdout
+        # the preview generator runs in its own processes, see PreviewPipeline
 
         # place holder for file system monitoring
         self.observer = None
@@ -323,17 +342,31 @@ class GlobalData:
         self.db_conn = self.db_engine.connect()
         metadata = MetaData()
         self.tb_items = Table('items', metadata,
+                              Column('id', Integer, primary_key=True),
                               Column('dir', String, index=True),
-                              Column('path', String, primary_key=True, index=True),
+                              Column('path', String, unique=True, index=True),
                               Column('shahash', String, index=True),
-                              Column('thumb', String),
-                              Column('labels', String),
+                              Column('thumb', String, index=True),
                               Column('bibleref', String, index=True),
                               Column('related', String),
-                              Column('date_created', String))
+                              Column('date_created', String),
+                              Column('size', Integer),
+                              Column('mtime_ns', Integer),
+                              Column('inode', Integer),
+                              Column('fingerprint', String, index=True),
+                              Column('thumb_state', String))  # 'pending', 'done' or 'failed'
 
         self.tb_labels = Table('labels', metadata,
-                               Column('label', String, index=True))
+                               Column('id', Integer, primary_key=True),
+                               Column('label', String, unique=True, index=True))
+
+        # which items have which labels. Keyed by label, so a label search is a range of
+        # this table, and the index by item serves displaying an item's labels.
+        self.tb_item_labels = Table('item_labels', metadata,
+                                    Column('label_id', Integer, primary_key=True),
+                                    Column('item_id', Integer, primary_key=True),
+                                    Index('ix_item_labels_item_id', 'item_id', 'label_id'),
+                                    sqlite_with_rowid=False)
 
         self.tb_mdata = Table('mdata', metadata,
                          Column('keycol', String, primary_key=True, index=True),
@@ -344,16 +377,23 @@ class GlobalData:
 
         if self.fresh_data:  # first time through, create the tables
             metadata.create_all(self.db_engine)
+            # stamp the layout version, so update-db.py knows where we started from
+            self.db_conn.execute(self.tb_mdata.insert(None), keycol='database_version',
+                                 valcol=str(DATABASE_VERSION))
             LOG.info('First time database setup completed.')
-            self.all_paths = set()  # empty set of existing paths in database
-        else:
-            # used to track databaase paths found (so that unfound ones can be deleted
-            self.all_paths = set()
-            sel = sqlselect([self.tb_items.c.path, ])
-            result = self.db_conn.execute(sel)
-            for row in result.fetchall():
-                # have to make these paths match filesystem paths...
-                self.all_paths.add(Path(row[0]))
+
+        # an item's labels go with it, whichever way it is deleted
+        self.db_conn.execute(sqltext(ITEM_LABELS_TRIGGER))
+
+        # WAL journaling, so readers don't wait on the writer (this connection) or block it
+        self.db_conn.execute(sqltext('PRAGMA journal_mode=WAL'))
+        # A pool of read-only connections for the web UI threads to read with directly (see
+        # db_read); writes all still go through db_conn on the main thread.
+        read_uri = DATABASE_PATH.absolute().as_uri() + '?mode=ro'
+        self.read_engine = create_engine(
+            'sqlite+pysqlite://', poolclass=QueuePool, pool_size=READ_POOL_SIZE,
+            max_overflow=0, pool_timeout=150,
+            creator=lambda: sqlite3.connect(read_uri, uri=True, check_same_thread=False))
 
         # fill lablels with fruits for dev testing, unless they already exist
         # sel = sqlselect([self.tb_labels.c.label, ]).order_by('label')
@@ -370,10 +410,19 @@ class GlobalData:
         # Other important data structures
         self.browse_list_object = None
         self.updates = False
+        # set once changes to the items are committed, so /browselist builds the tree again
         self.updates_browse_list = False
-        self.search_results_map = None
-        self.search_results_biblerefs = None
+        # search id -> SearchResults, for the requests search pages make afterwards
+        self.searches = OrderedDict()
+        self.search_ids = itertools.count(1)
+        self.searches_lock = threading.Lock()  # searches run on the web server's threads
         self.New = False  # indicate whether new items have been added
+        # progress of the initial scan, for /scan_status - kept up by ScanReconciler
+        self.scan_status = dict(state='waiting')
+
+        # background preview generation and move verification, started from main()
+        self.previews = PreviewPipeline()
+        self.verifier = HashVerifier()
 
     def nothing(self):
         """Keeping pylint happy"""
@@ -391,15 +440,7 @@ def search_path(pathname):
     result.close()
     # expect only one result
     if len(rows) == 1:
-        row = rows[0]
-        # print(f'search_path: row[1] "{row[1]}" of type {type(row[1])}' \
-        #      + f' row[3] "{row[3]}" of type {type(row[3])}')
-        # sys.stdout.flush()
-        if row[3] is None:
-            item = ItemEntry(Path(row[1]), row[2], row[3], row[4])
-        else:
-            item = ItemEntry(Path(row[1]), row[2], Path(row[3]), row[4])
-        return item
+        return item_from_row(rows[0])
     if len(rows) > 1:
         raise DDMSException(f'Multiple matches for path {str_pathname}')
     else:
@@ -408,40 +449,197 @@ def search_path(pathname):
 
 def search_hash(shahash):
     """search database according to sha hash"""
-    # return either False or the item found
+    # duplicate files are allowed, so this returns a list of all the items found
     sel = sqlselect([GLOBAL_DATA.tb_items, ]).where(GLOBAL_DATA.tb_items.c.shahash == shahash)
     result = GLOBAL_DATA.db_conn.execute(sel)
     rows = result.fetchall()
     result.close()
-    # expect only one result
-    if len(rows) == 1:
-        row = rows[0]
-        item = ItemEntry(Path(row[0]), row[1], Path(row[2]), row[3])
-        return item
-    if len(rows) > 1:
-        raise DDMSException(f'Multiple matches for shashash {shahash}')
+    return [item_from_row(row) for row in rows]
+
+
+def load_snapshot(directory=None):
+    """
+    What the database knows about each path, for the initial scan to diff against the
+    directory tree - read in one query. Paths are left as the strings stored in the
+    database, which is how the scan looks them up. Given a directory, just what is below it.
+    """
+    snapshot = dict()
+    columns = GLOBAL_DATA.tb_items.c
+    sel = sqlselect([columns.path, columns.size, columns.mtime_ns, columns.inode,
+                     columns.fingerprint, columns.shahash])
+    if directory:
+        sel = sel.where(directory_range(columns.path, str(directory)))
+    result = GLOBAL_DATA.db_conn.execute(sel)
+    for row in result:
+        snapshot[row[0]] = SnapshotEntry(*row[1:])
+    result.close()
+    return snapshot
+
+
+def get_mdata(key, default=None):
+    """read a value from the mdata key/value table"""
+    sel = sqlselect([GLOBAL_DATA.tb_mdata.c.valcol, ]).where(GLOBAL_DATA.tb_mdata.c.keycol == key)
+    result = GLOBAL_DATA.db_conn.execute(sel)
+    row = result.fetchone()
+    result.close()
+    if row is None:
+        return default
+    return row[0]
+
+
+def set_mdata(values, batch=None):
+    """write a dict of key/values to the mdata table, replacing any already there"""
+    insert = GLOBAL_DATA.tb_mdata.insert(None).prefix_with('OR REPLACE')
+    rows = [{'keycol': key, 'valcol': str(value)} for key, value in values.items()]
+    if batch is None:
+        GLOBAL_DATA.db_conn.execute(insert, rows)
     else:
-        return False
+        batch.execute(insert, rows)
+
+
+def item_from_row(row):
+    """build an ItemEntry from a full row of the items table"""
+    stat = (row.size, row.mtime_ns, row.inode)
+    if row.thumb is None:
+        thumbnail = None
+    else:
+        thumbnail = Path(row.thumb)
+    return ItemEntry(Path(row.path), row.shahash, thumbnail, stat=stat, fingerprint=row.fingerprint)
 
 
 def get_hash(pathname):
     """
     read a file and return the sha 512 hash of its contents
     """
-    # read every file as an array of bytes
-    return sha512(pathname.read_bytes()).digest()
+    # Read through one fixed size buffer, so memory use doesn't depend on the file size.
+    # Both the raw reads and sha512 on a chunk this big run with the GIL released, so a
+    # huge file doesn't starve the web server thread.
+    hasher = sha512()
+    buffer = bytearray(HASH_CHUNK_SIZE)
+    view = memoryview(buffer)
+    with pathname.open('rb', buffering=0) as file:
+        while True:
+            count = file.readinto(buffer)
+            if not count:
+                break
+            hasher.update(view[:count])
+    return hasher.digest()
+
 
-        
-        
+def get_stat(pathname):
+    """
+    return the (size, mtime_ns, inode) tuple used to tell whether a file has changed
+    since it was last hashed
+    """
+    stat_result = pathname.stat()
+    return stat_result.st_size, stat_result.st_mtime_ns, stat_result.st_ino
 
 
-def get_preview(pathname):
-    """ get jpeg preview of item """
+def get_fingerprint(pathname, size=None):
+    """
+    Cheap first-tier identity of a file: its size plus a hash of the first and last blocks.
+    Different fingerprints mean different contents, so the full hash is only needed when a
+    fingerprint matches. Costs a couple of blocks of reading, whatever the file size.
+    """
+    block = FINGERPRINT_BLOCK_SIZE
+    hasher = sha512()
+    with pathname.open('rb') as file:
+        if size is None:
+            size = os.fstat(file.fileno()).st_size
+        hasher.update(file.read(block))
+        if size > block:
+            file.seek(max(size - block, block))
+            hasher.update(file.read(block))
+    return f'{size}:{hasher.hexdigest()[:32]}'
+
+
+def thumb_for_hash(shahash):
+    """
+    Previews are stored by content: this is where the preview for a given sha hash lives,
+    relative to THUMBNAIL_DIRECTORY. Duplicates and moved files all share the one preview.
+    """
+    key = shahash.hex()
+    return f'{key[:2]}/{key}.jpeg'
+
+
+def referenced_thumbs(thumbs, chunk_size=500):
+    """which of these stored previews some item refers to (a reference count above zero)"""
+    thumbs = [str(thumb) for thumb in thumbs if thumb]
+    found = set()
+    for start in range(0, len(thumbs), chunk_size):
+        sel = sqlselect([GLOBAL_DATA.tb_items.c.thumb, ]).distinct() \
+            .where(GLOBAL_DATA.tb_items.c.thumb.in_(thumbs[start:start + chunk_size]))
+        result = GLOBAL_DATA.db_conn.execute(sel)
+        found.update(row[0] for row in result.fetchall())
+        result.close()
+    return found
+
+
+def release_thumbs(thumbs):
+    """some items let go of these previews, remove the ones nothing refers to any more"""
+    thumbs = {str(thumb) for thumb in thumbs if thumb}
+    in_use = referenced_thumbs(thumbs)
+    for thumb in thumbs:
+        if thumb not in in_use:
+            thumb_file = THUMBNAIL_DIRECTORY.joinpath(thumb)
+            if thumb_file.exists():
+                thumb_file.unlink()
+                LOG.info('Removed unreferenced preview %s', thumb)
+            # and the smaller sizes made from it
+            for sized_file in thumb_file.parent.glob(thumb_file.stem + '-*'):
+                sized_file.unlink()
+
+
+def thumbnail_format():
+    """(file extension, Pillow save options) for the scaled thumbnails"""
+    from PIL import features as pil_features  # deferred, not needed to get started
+    if THUMBNAIL_FORMAT == 'webp' and pil_features.check('webp'):
+        return 'webp', dict(format='WEBP', quality=80, method=4)
+    return 'jpeg', dict(format='JPEG', quality=80, optimize=True, progressive=True)
+
+
+def sized_thumb(thumb, size):
+    """
+    The preview thumb scaled to fit size x size, relative to THUMBNAIL_DIRECTORY. Scaled
+    copies are made from the full size preview the first time they're asked for, then kept
+    next to it as <hash>-<size>.<ext>. Returns thumb itself for the largest size, or if the
+    preview can't be scaled.
+    """
+    if size >= max(THUMBNAIL_SIZES):
+        return thumb
+    thumb_file = THUMBNAIL_DIRECTORY.joinpath(thumb)
+    extension, save_options = thumbnail_format()
+    sized_file = thumb_file.with_name(f'{thumb_file.stem}-{size}.{extension}')
+    if not sized_file.exists():
+        try:
+            from PIL import Image  # deferred, not needed to get started
+            with Image.open(str(thumb_file)) as image:
+                image.thumbnail((size, size))
+                if image.mode not in ('RGB', 'L'):
+                    image = image.convert('RGB')
+                # write under another name first, so nothing ever serves half a file
+                partial_file = sized_file.with_name(sized_file.name + '.partial')
+                image.save(str(partial_file), **save_options)
+            os.replace(str(partial_file), str(sized_file))
+        except Exception as exception_info:
+            LOG.info('Could not scale preview %s to %d: %s', thumb, size, exception_info)
+            return thumb
+    return str(Path(thumb).with_name(sized_file.name))
+
+
+def get_preview(manager, pathname, thumb):
+    """ get jpeg preview of item, stored as thumb (see thumb_for_hash) """
     if isinstance(pathname, Path):
         pathname = str(pathname)
     try:
-        preview = GLOBAL_DATA.preview.get_jpeg_preview(pathname, height=200, width=200)
-        thumb_path = str(Path(preview).relative_to(THUMBNAIL_DIRECTORY))
+        # render the biggest size, the smaller ones are scaled from it (sized_thumb)
+        preview = manager.get_jpeg_preview(pathname, height=max(THUMBNAIL_SIZES),
+                                           width=max(THUMBNAIL_SIZES))
+        # move it from the preview manager's name (based on the path) to the content name
+        thumb_file = THUMBNAIL_DIRECTORY.joinpath(thumb)
+        thumb_file.parent.mkdir(exist_ok=True)
+        os.replace(preview, str(thumb_file))
+        thumb_path = thumb
         LOG.info('Preview generation complete')
     except Exception:
         ## handle unsupported mimetype exception -- create blank jpg file
@@ -454,26 +652,370 @@ def get_preview(pathname):
     return thumb_path
 
 
-def add_item(pathname, shahash=None):
+def preview_process(connection, thumbnail_directory, memory_limit):
+    """
+    Body of a preview worker process: receives (str_pathname, thumb) jobs on connection and
+    sends back the thumb path, or None if it couldn't make one. Runs in its own process
+    group with its memory capped, so a bad file can only take out this process (and the
+    LibreOffice/ImageMagick it started), never the main program.
+    """
+    global THUMBNAIL_DIRECTORY
+    THUMBNAIL_DIRECTORY = thumbnail_directory  # may be different from the constants default
+
+    if hasattr(os, 'setsid'):
+        os.setsid()  # so the converters it starts can be killed along with it
+    if memory_limit and resource is not None:
+        resource.setrlimit(resource.RLIMIT_AS, (memory_limit, memory_limit))
+
+    # heavy, and only these worker processes need it
+    from preview_generator.manager import PreviewManager
+
+    # startup preview generator - this guy wants to emit useless messages
+    # when starting, tried to throw away with assignmet to os.devnull. That
+    # was broken, it wants to see a real file. So, try a temporary file.
+    # THIS is DANGEROUS - you can miss a real error.
+    save_stdout = sys.stdout
+    tempfile = TemporaryFile(mode='w', suffix='txt')
+    sys.stdout = tempfile
+    try:
+        manager = PreviewManager(str(THUMBNAIL_DIRECTORY), create_folder=True)
+    finally:
+        sys.stdout.close()
+        sys.stdout = save_stdout
+
+    while True:
+        try:
+            str_pathname, thumb = connection.recv()
+        except EOFError:
+            return  # main program went away
+        thumb_path = get_preview(manager, str_pathname, thumb)
+        if thumb_path:
+            # search results will want this one straight away
+            sized_thumb(thumb_path, THUMBNAIL_DEFAULT_SIZE)
+        connection.send(thumb_path)
+
+
+class PreviewPipeline:
+    """
+    Generates previews in the background, so adding an item doesn't wait on LibreOffice
+    or ImageMagick. Items go into the database with thumb_state 'pending' and are requested
+    here. Requests are by content (sha hash), so identical files are rendered once. Finished
+    previews are handed back on QUEUE, so the thumb column is updated from the main
+    (database) thread. Urgent requests - items showing in the current search results - jump
+    the line.
+
+    Each worker thread hands its jobs to a worker process of its own (preview_process). A job
+    that takes longer than PREVIEW_TIMEOUT gets the process killed, as does one that crashes
+    it, and a new process is started for the next job. Content that failed is remembered
+    (thumb_state 'failed') and not tried again.
+    """
+
+    def __init__(self, workers=PREVIEW_WORKERS):
+        self.workers = workers
+        self.jobs = queue.PriorityQueue()  # (priority, sequence, thumb, str_pathname)
+        self.queued = dict()  # thumb -> priority it is currently queued at
+        self.failed = set()  # thumbs for content the preview generator can't handle
+        self.lock = threading.Lock()
+        self.sequence = itertools.count()  # keeps equal priorities first come, first served
+
+    def start(self):
+        """start up the worker threads"""
+        for number in range(self.workers):
+            threading.Thread(target=self.work, name=f'preview-{number}', daemon=True).start()
+
+    def request(self, pathname, shahash, urgent=False):
+        """ask for a preview of an item, unless its content is already queued at that priority"""
+        thumb = thumb_for_hash(shahash)
+        priority = 0 if urgent else 1
+        with self.lock:
+            if self.queued.get(thumb, 2) <= priority:
+                return
+            self.queued[thumb] = priority
+        self.jobs.put((priority, next(self.sequence), thumb, str(pathname)))
+
+    @staticmethod
+    def start_process():
+        """start a preview worker process, returns it and our end of its pipe"""
+        context = multiprocessing.get_context('spawn')  # don't fork this multi-threaded program
+        connection, child_connection = context.Pipe()
+        process = context.Process(target=preview_process, daemon=True,
+                                  args=(child_connection, THUMBNAIL_DIRECTORY,
+                                        PREVIEW_MEMORY_LIMIT))
+        process.start()
+        child_connection.close()
+        return process, connection
+
+    @staticmethod
+    def stop_process(process):
+        """kill a preview worker process, along with any converter it is running"""
+        try:
+            if hasattr(os, 'killpg'):
+                os.killpg(process.pid, signal.SIGKILL)
+            else:
+                process.kill()
+        except (ProcessLookupError, PermissionError):
+            pass  # already gone
+        process.join()
+
+    def work(self):
+        """worker thread - generate previews until the program exits"""
+        process = connection = None
+        while True:
+            priority, _, thumb, str_pathname = self.jobs.get()
+            with self.lock:
+                if self.queued.get(thumb) != priority:
+                    continue  # stale copy of a request that was bumped up and already done
+                del self.queued[thumb]
+            if THUMBNAIL_DIRECTORY.joinpath(thumb).exists():
+                thumb_path = thumb  # same content was rendered for another item
+            else:
+                thumb_path = None
+                try:
+                    if process is None or not process.is_alive():
+                        process, connection = self.start_process()
+                    connection.send((str_pathname, thumb))
+                    if connection.poll(PREVIEW_TIMEOUT):
+                        try:
+                            thumb_path = connection.recv()
+                        except EOFError:
+                            LOG.error('Preview worker crashed on %s', str_pathname)
+                            self.stop_process(process)
+                            process = None
+                    else:
+                        LOG.error('Preview of %s timed out, restarting preview worker', str_pathname)
+                        self.stop_process(process)
+                        process = None
+                except Exception:
+                    # e.g. the process died just before the send (BrokenPipeError), or
+                    # couldn't be started - this thread has to keep going regardless
+                    LOG.exception('Preview worker failed on %s, restarting it', str_pathname)
+                    if process is not None:
+                        try:
+                            self.stop_process(process)
+                        except Exception:
+                            LOG.exception('Could not stop preview worker')
+                    process = None
+                if thumb_path is None:
+                    self.failed.add(thumb)
+            QUEUE.put({'type': 'preview', 'thumb': thumb, 'result': thumb_path})
+
+
+def request_pending_previews():
+    """queue up the previews a previous run didn't get to, and note the ones that failed"""
+    sel = sqlselect([GLOBAL_DATA.tb_items.c.path, GLOBAL_DATA.tb_items.c.shahash,
+                     GLOBAL_DATA.tb_items.c.thumb_state]) \
+        .where(GLOBAL_DATA.tb_items.c.thumb_state.in_(['pending', 'failed']))
+    result = GLOBAL_DATA.db_conn.execute(sel)
+    for row in result.fetchall():
+        if row[2] == 'pending':
+            GLOBAL_DATA.previews.request(row[0], row[1])
+        else:
+            GLOBAL_DATA.previews.failed.add(thumb_for_hash(row[1]))
+    result.close()
+
+
+def update_item_thumb(thumb, thumb_path):
+    """
+    a background preview is done, record it on every pending item with that content
+    (runs in the main thread)
+    """
+    tb_items = GLOBAL_DATA.tb_items
+    shahash = bytes.fromhex(Path(thumb).stem)
+    if thumb_path and not THUMBNAIL_DIRECTORY.joinpath(thumb_path).exists():
+        # the worker found an existing preview, but it was released (or swept up) before
+        # this got here - make it again for whatever is still waiting on it
+        sel = sqlselect([tb_items.c.path, ]) \
+            .where(tb_items.c.thumb_state == 'pending') \
+            .where(tb_items.c.shahash == shahash).limit(1)
+        result = GLOBAL_DATA.db_conn.execute(sel)
+        row = result.fetchone()
+        result.close()
+        if row is not None:
+            GLOBAL_DATA.previews.request(row[0], shahash)
+        return
+    update = tb_items.update(None) \
+        .where(tb_items.c.thumb_state == 'pending') \
+        .where(tb_items.c.shahash == shahash) \
+        .values(thumb=thumb_path, thumb_state='failed' if thumb_path is None else 'done')
+    result = GLOBAL_DATA.db_conn.execute(update)
+    if result.rowcount == 0 and thumb_path:
+        # the items went away while the preview was being made
+        release_thumbs([thumb_path])
+
+
+class HashVerifier:
+    """
+    Checks the full hash of the items a scan took as moved on their fingerprint, size,
+    mtime and inode alone, in a background thread, so the scan doesn't wait on reading
+    them. The hashes are handed back on QUEUE; an item whose contents turn out to be
+    different after all is updated like a modified file, see verify_item_hash.
+    """
+
+    def __init__(self):
+        self.jobs = queue.Queue()  # (str_pathname, stat)
+
+    def start(self):
+        """start up the worker thread"""
+        threading.Thread(target=self.work, name='hash-verifier', daemon=True).start()
+
+    def request(self, pathname, stat):
+        """ask for the full hash of an item, stat being what the scan saw"""
+        self.jobs.put((str(pathname), stat))
+
+    def work(self):
+        """worker thread - hash the files asked about until the program exits"""
+        while True:
+            str_pathname, stat = self.jobs.get()
+            try:
+                shahash = get_hash(Path(str_pathname))
+            except OSError:
+                continue  # gone again, the filesystem monitor sees to that
+            QUEUE.put({'type': 'verify', 'path': str_pathname, 'shahash': shahash,
+                       'stat': stat})
+
+
+def verify_item_hash(str_pathname, shahash, stat):
+    """
+    the background hash of an item taken as moved is in (runs in the main thread). If the
+    contents are different after all, update it as modified - unless the file was changed
+    again since, then the filesystem monitor has that in hand.
+    """
+    pathname = Path(str_pathname)
+    item = search_path(pathname)
+    if item is None or item.shahash == shahash:
+        return
+    try:
+        if get_stat(pathname) != stat:
+            return
+    except OSError:
+        return
+    LOG.info('Moved item %s has different contents after all', str_pathname)
+    update_item_hash_thumb(pathname, shahash, stat)
+
+
+def preview_for_new_content(pathname, shahash):
+    """
+    Helper for adding or changing an item - the (thumb, thumb_state) it starts out with.
+    Content that already has a preview reuses it, content the preview generator already
+    failed on isn't tried again, anything else is requested in the background.
+    """
+    thumb = thumb_for_hash(shahash)
+    if THUMBNAIL_DIRECTORY.joinpath(thumb).exists():
+        return thumb, 'done'
+    if thumb in GLOBAL_DATA.previews.failed:
+        return None, 'failed'
+    GLOBAL_DATA.previews.request(pathname, shahash)
+    return None, 'pending'
+
+
+class IngestBatch:
+    """
+    Collects the database writes of a scan and commits them together, one transaction per
+    INGEST_BATCH_SIZE items or INGEST_BATCH_MS milliseconds, whichever comes first. Each
+    file's writes all land in the same transaction, so a crash loses at most the files of
+    the last open batch, and those are simply found again by the next scan.
+    """
+
+    def __init__(self, batch_size=INGEST_BATCH_SIZE, batch_ms=INGEST_BATCH_MS):
+        self.batch_size = batch_size
+        self.batch_seconds = batch_ms / 1000
+        self.item_rows = list()
+        self.new_rows = list()
+        self.updates = list()
+        self.released_thumbs = list()  # previews to check for references after the commit
+        self.started = None  # time the first write of this batch arrived
+
+    def add(self, item_row):
+        """queue up a new item, which also goes on the new table"""
+        self.item_rows.append(item_row)
+        self.new_rows.append({'path': item_row['path']})
+        self.written()
+
+    def execute(self, statement, params=None):
+        """
+        queue up some other write, e.g. an update of an existing item. With a list of
+        params, the statement is run once for each (executemany).
+        """
+        self.updates.append((statement, params))
+        self.written()
+
+    def written(self):
+        """helper - start the clock on a batch and flush when it is full"""
+        if self.started is None:
+            self.started = time.time()
+        self.flush_if_due()
+
+    def flush_if_due(self):
+        """flush when the batch has enough rows or has been open long enough"""
+        if self.started is None:
+            return
+        if len(self.item_rows) + len(self.updates) >= self.batch_size \
+                or time.time() - self.started >= self.batch_seconds:
+            self.flush()
+
+    def flush(self):
+        """write everything queued up in a single transaction"""
+        if self.started is None:
+            return
+        with GLOBAL_DATA.db_conn.begin():
+            if self.item_rows:
+                GLOBAL_DATA.db_conn.execute(GLOBAL_DATA.tb_items.insert(None), self.item_rows)
+                GLOBAL_DATA.db_conn.execute(GLOBAL_DATA.tb_new.insert(None), self.new_rows)
+            for statement, params in self.updates:
+                if params:
+                    GLOBAL_DATA.db_conn.execute(statement, params)
+                else:
+                    GLOBAL_DATA.db_conn.execute(statement)
+        LOG.info('Committed batch of %d new items and %d updates',
+                 len(self.item_rows), len(self.updates))
+        GLOBAL_DATA.updates_browse_list = True
+        release_thumbs(self.released_thumbs)
+        self.item_rows = list()
+        self.new_rows = list()
+        self.updates = list()
+        self.released_thumbs = list()
+        self.started = None
+
+
+def execute_write(statement, batch=None):
+    """run a write now, or queue it on the scan's batch if there is one"""
+    if batch is None:
+        GLOBAL_DATA.db_conn.execute(statement)
+    else:
+        batch.execute(statement)
+
+
+def dir_key(pathname):
+    """
+    The dir column for an item: its directory with / separators whatever the platform, ''
+    at the top level. The searches look directories up by this, see directories_condition.
+    """
+    str_dir = pathname.parent.as_posix()
+    if str_dir == '.':
+        str_dir = ''
+    return str_dir
+
+
+def add_item(pathname, shahash=None, stat=None, batch=None, fingerprint=None):
     """add a completely new item to database"""
     global GLOBAL_DATA
 
     LOG.info('adding item')
     str_pathname = str(pathname)
-    str_dir = str(pathname.parent)
-    if str_dir == '.':
-        str_dir = ''
+    str_dir = dir_key(pathname)
 
-    if shahash is None:
-        # Handle exception thrown if file is deleted between discovery and adding.
-        try:
+    # Handle exception thrown if file is deleted between discovery and adding.
+    try:
+        if shahash is None or stat is None:
+            stat = get_stat(pathname)
             shahash = get_hash(pathname)
-        except:
-            LOG.info('File has disappeared')
-            return
-    # generate jpeg thumbnail file and capture its path as string
-
-    thumb_path = get_preview(pathname)
+        if fingerprint is None:
+            fingerprint = get_fingerprint(pathname, stat[0])
+    except:
+        LOG.info('File has disappeared')
+        return
+    # the jpeg thumbnail is shared with identical content, or made in the background
+    thumb_path, thumb_state = preview_for_new_content(pathname, shahash)
 
     # just for development - we will assign a random fruit label 50% of the time.
     # random_int = random.randrange(2*len(DESIRED_FRUITS))
@@ -482,13 +1024,20 @@ def add_item(pathname, shahash=None):
     # else:
     #     labels = ''
 
-    labels = ''
-    insert = GLOBAL_DATA.tb_items.insert(None)
-    GLOBAL_DATA.db_conn.execute(insert, dir=str_dir, path=str_pathname, shahash=shahash,
-                                thumb=thumb_path, labels=labels, bibleref=None, date_created=time.ctime(os.path.getctime(str_pathname)))
-    # add to new items table
-    insert = GLOBAL_DATA.tb_new.insert(None)
-    GLOBAL_DATA.db_conn.execute(insert, path=str_pathname)
+    item_row = dict(dir=str_dir, path=str_pathname, shahash=shahash,
+                    thumb=thumb_path, thumb_state=thumb_state, bibleref=None,
+                    date_created=time.ctime(os.path.getctime(str_pathname)),
+                    size=stat[0], mtime_ns=stat[1], inode=stat[2],
+                    fingerprint=fingerprint)
+    if batch is not None:
+        # during a scan, the item and its new table entry are committed with the batch
+        batch.add(item_row)
+    else:
+        insert = GLOBAL_DATA.tb_items.insert(None)
+        GLOBAL_DATA.db_conn.execute(insert, **item_row)
+        # add to new items table
+        insert = GLOBAL_DATA.tb_new.insert(None)
+        GLOBAL_DATA.db_conn.execute(insert, path=str_pathname)
 
     # set the New flag
     GLOBAL_DATA.New = True
@@ -496,47 +1045,111 @@ def add_item(pathname, shahash=None):
     LOG.info('Added item: %s', pathname)
 
 
-def update_item_path(old_pathname, new_pathname):
+def update_item_path(old_pathname, new_pathname, stat=None, batch=None):
     """update an existing database entry"""
-    str_new_dir = str(new_pathname.parent)
-    if str_new_dir == '.':
-        str_new_dir = ''
-
+    values = dict(dir=dir_key(new_pathname), path=str(new_pathname))
+    if stat is not None:  # a move usually keeps these, but a copy across filesystems won't
+        values.update(size=stat[0], mtime_ns=stat[1], inode=stat[2])
     update = GLOBAL_DATA.tb_items.update(None) \
         .where(GLOBAL_DATA.tb_items.c.path == str(old_pathname)) \
-        .values(dir=str_new_dir, path=str(new_pathname))
-    GLOBAL_DATA.db_conn.execute(update)
+        .values(**values)
+    execute_write(update, batch)
+    # keep its place on the new list, if it has one
+    update = GLOBAL_DATA.tb_new.update(None) \
+        .where(GLOBAL_DATA.tb_new.c.path == str(old_pathname)) \
+        .values(path=str(new_pathname))
+    execute_write(update, batch)
     LOG.info('Update path of item: was: %s, changed to %s', old_pathname, new_pathname)
 
 
-def update_item_hash_thumb(pathname, shahash=None):
-    """file contents changed, update hash and thumbnail"""
+def move_items(moves, batch=None):
+    """
+    Bulk version of update_item_path, for a list of (old_pathname, new_pathname, stat).
+    Runs as one executemany per table.
+    """
+    if not moves:
+        return
+    item_rows = list()
+    new_rows = list()
+    for old_pathname, new_pathname, stat in moves:
+        item_rows.append({'old_path': str(old_pathname), 'new_path': str(new_pathname),
+                          'new_dir': dir_key(new_pathname), 'new_size': stat[0],
+                          'new_mtime_ns': stat[1], 'new_inode': stat[2]})
+        new_rows.append({'old_path': str(old_pathname), 'new_path': str(new_pathname)})
+        LOG.info('Update path of item: was: %s, changed to %s', old_pathname, new_pathname)
+
+    tb_items = GLOBAL_DATA.tb_items
+    update_items = tb_items.update(None) \
+        .where(tb_items.c.path == bindparam('old_path')) \
+        .values(path=bindparam('new_path'), dir=bindparam('new_dir'),
+                size=bindparam('new_size'), mtime_ns=bindparam('new_mtime_ns'),
+                inode=bindparam('new_inode'))
+    update_new = GLOBAL_DATA.tb_new.update(None) \
+        .where(GLOBAL_DATA.tb_new.c.path == bindparam('old_path')) \
+        .values(path=bindparam('new_path'))
+    if batch is None:
+        with GLOBAL_DATA.db_conn.begin():
+            GLOBAL_DATA.db_conn.execute(update_items, item_rows)
+            GLOBAL_DATA.db_conn.execute(update_new, new_rows)
+    else:
+        batch.execute(update_items, item_rows)
+        batch.execute(update_new, new_rows)
+
+
+def update_item_hash_thumb(pathname, shahash=None, stat=None, batch=None, released=None):
+    """
+    file contents changed, update hash and thumbnail. The old preview is released after the
+    batch commits, or is added to the released list for the caller to release after its own
+    commit, or else released right away.
+    """
     item = search_path(pathname)
     if item:
         str_pathname = str(pathname)
-        if shahash is None:
+        if shahash is None or stat is None:
+            stat = get_stat(pathname)
             shahash = get_hash(pathname)
-        # going to change thumbnail, so delete the old file to keep things under control
-        thumbpath = Path(item.thumbnail)
-        thumbpath.unlink()
-        # generate jpeg thumbnail
-        thumb_path = get_preview(pathname)
+        fingerprint = get_fingerprint(pathname, stat[0])
+        # new contents, new preview - shared or made in the background
+        thumb_path, thumb_state = preview_for_new_content(pathname, shahash)
         update = GLOBAL_DATA.tb_items.update(None) \
             .where(GLOBAL_DATA.tb_items.c.path == str_pathname) \
-            .values(shahash=shahash, thumb=thumb_path)
-        GLOBAL_DATA.db_conn.execute(update)
+            .values(shahash=shahash, thumb=thumb_path, thumb_state=thumb_state,
+                    fingerprint=fingerprint, size=stat[0], mtime_ns=stat[1], inode=stat[2])
+        execute_write(update, batch)
+        # the old preview goes, unless other items still use it
+        if item.thumbnail:
+            if batch is not None:
+                batch.released_thumbs.append(str(item.thumbnail))
+            elif released is not None:
+                released.append(str(item.thumbnail))
+            else:
+                release_thumbs([str(item.thumbnail)])
         LOG.info('Update hash/preview of item %s', str_pathname)
 
 
-def delete_item(pathname):
-    """delete an item from the database"""
+def update_item_stat(pathname, stat, batch=None):
+    """contents are the same, but the file was touched - remember the new stat values"""
+    update = GLOBAL_DATA.tb_items.update(None) \
+        .where(GLOBAL_DATA.tb_items.c.path == str(pathname)) \
+        .values(size=stat[0], mtime_ns=stat[1], inode=stat[2])
+    execute_write(update, batch)
+
+
+def update_item_fingerprint(pathname, fingerprint, batch=None):
+    """fill in the fingerprint for an item recorded before fingerprints existed"""
+    update = GLOBAL_DATA.tb_items.update(None) \
+        .where(GLOBAL_DATA.tb_items.c.path == str(pathname)) \
+        .values(fingerprint=fingerprint)
+    execute_write(update, batch)
+
+
+def delete_item(pathname, released=None):
+    """
+    delete an item from the database. Given a released list, its preview goes on that, for
+    the caller to release once it has committed.
+    """
     item = search_path(pathname)
     if item:
-        # clean up the preview
-        if item.thumbnail:
-            thumb = Path(item.thumbnail)
-            if thumb.exists():
-                thumb.unlink()
         # delete item from database
         dele = GLOBAL_DATA.tb_items.delete(None).where(GLOBAL_DATA.tb_items.c.path == str(pathname))
         GLOBAL_DATA.db_conn.execute(dele)
@@ -545,49 +1158,450 @@ def delete_item(pathname):
         dele = GLOBAL_DATA.tb_new.delete(None).where(GLOBAL_DATA.tb_new.c.path == str(pathname))
         GLOBAL_DATA.db_conn.execute(dele)
 
+        # clean up the preview, unless other items still use it
+        if item.thumbnail:
+            if released is not None:
+                released.append(str(item.thumbnail))
+            else:
+                release_thumbs([str(item.thumbnail)])
+
         LOG.info('Deleted item, path was %s', pathname)
 
 
-def add_if_missing(pathname):
-    """determine if the seemingly added file requires database update"""
-    # is the path in the data?
-    # we don't need to run this block if we are starting the first time
-    if not GLOBAL_DATA.fresh_data:
-        shahash = get_hash(pathname)
-        # first look for the path
-        found_path = search_path(pathname)
-        if found_path:
-            # remove this path from the set of all paths previously in db
-            GLOBAL_DATA.all_paths.remove(found_path.pathname)
-
-            if shahash == found_path.shahash:
-                return  # it is already there, so return
-            # hash changed, so update existing item
-            update_item_hash_thumb(pathname, shahash)
-        else:  # path not found, what about the shahash?
-            found_hash = search_hash(shahash)
-            if found_hash:
-                # found a match for shahash,
-                # if the filename matches, then assume the file was moved and if it
-                # doesn't match, then the file name was changed. Either way, the action
-                # is the same: update the path in the database
-                update_item_path(found_hash.pathname, pathname)
+def delete_items(pathnames, chunk_size=500):
+    """
+    Bulk version of delete_item, for a list of paths. Works through them in chunks: one
+    query for the chunk's thumbnails, one transaction deleting the chunk's rows, then the
+    previews nothing refers to any more are removed.
+    """
+    str_pathnames = [str(pathname) for pathname in pathnames]
+    tb_items = GLOBAL_DATA.tb_items
+    tb_new = GLOBAL_DATA.tb_new
+    for start in range(0, len(str_pathnames), chunk_size):
+        chunk = str_pathnames[start:start + chunk_size]
+        sel = sqlselect([tb_items.c.thumb, ]).where(tb_items.c.path.in_(chunk))
+        result = GLOBAL_DATA.db_conn.execute(sel)
+        thumbs = [row[0] for row in result.fetchall() if row[0]]
+        result.close()
+
+        rows = [{'old_path': str_pathname} for str_pathname in chunk]
+        with GLOBAL_DATA.db_conn.begin():
+            GLOBAL_DATA.db_conn.execute(
+                tb_items.delete(None).where(tb_items.c.path == bindparam('old_path')), rows)
+            GLOBAL_DATA.db_conn.execute(
+                tb_new.delete(None).where(tb_new.c.path == bindparam('old_path')), rows)
+        GLOBAL_DATA.updates_browse_list = True
+        release_thumbs(thumbs)
+        for str_pathname in chunk:
+            LOG.info('Deleted item, path was %s', str_pathname)
+
+
+def directory_range(column, str_directory, sep=os.sep):
+    """
+    where clause for everything below a directory - a range, so the index is used. sep is
+    '/' for the dir column, which is stored that way on every platform.
+    """
+    # sep sorts just before the character after it, so this is exactly the prefix
+    return sqland(column >= str_directory + sep,
+                  column < str_directory + chr(ord(sep) + 1))
+
 
+def move_directory(old_directory, new_directory):
+    """
+    A directory was moved or renamed - rewrite the path and dir of everything below it, in
+    a few statements rather than an update per item, all in one transaction. Anything the
+    database still had at the destination is deleted in it first.
+    """
+    str_old = str(old_directory)
+    str_new = str(new_directory)
+    # the dir column has / separators, see dir_key - same length, so the same cut works
+    dir_old = Path(old_directory).as_posix()
+    dir_new = Path(new_directory).as_posix()
+    tb_items = GLOBAL_DATA.tb_items
+    tb_new = GLOBAL_DATA.tb_new
+    cut = len(str_old) + 1  # substr() position just past the old prefix
+
+    sel = sqlselect([tb_items.c.thumb, ]).distinct() \
+        .where(directory_range(tb_items.c.path, str_new))
+    result = GLOBAL_DATA.db_conn.execute(sel)
+    thumbs = [row[0] for row in result.fetchall() if row[0]]
+    result.close()
+
+    with GLOBAL_DATA.db_conn.begin():
+        result = GLOBAL_DATA.db_conn.execute(
+            tb_items.delete(None).where(directory_range(tb_items.c.path, str_new)))
+        stale = result.rowcount
+        GLOBAL_DATA.db_conn.execute(
+            tb_new.delete(None).where(directory_range(tb_new.c.path, str_new)))
+        result = GLOBAL_DATA.db_conn.execute(
+            tb_items.update(None)
+            .where(directory_range(tb_items.c.path, str_old))
+            .values(path=sqlliteral(str_new) + sqlfunc.substr(tb_items.c.path, cut)))
+        moved = result.rowcount
+        GLOBAL_DATA.db_conn.execute(
+            tb_items.update(None).where(tb_items.c.dir == dir_old).values(dir=dir_new))
+        GLOBAL_DATA.db_conn.execute(
+            tb_items.update(None)
+            .where(directory_range(tb_items.c.dir, dir_old, '/'))
+            .values(dir=sqlliteral(dir_new) + sqlfunc.substr(tb_items.c.dir, cut)))
+        GLOBAL_DATA.db_conn.execute(
+            tb_new.update(None)
+            .where(directory_range(tb_new.c.path, str_old))
+            .values(path=sqlliteral(str_new) + sqlfunc.substr(tb_new.c.path, cut)))
+    GLOBAL_DATA.updates_browse_list = True
+    release_thumbs(thumbs)
+    if stale:
+        LOG.info('Deleted %d items already recorded under %s', stale, str_new)
+    LOG.info('Moved directory %s to %s, %d items', str_old, str_new, moved)
+
+
+def delete_directory(directory):
+    """
+    A directory was deleted - delete everything below it in one transaction, then remove
+    the previews nothing refers to any more.
+    """
+    str_directory = str(directory)
+    tb_items = GLOBAL_DATA.tb_items
+    tb_new = GLOBAL_DATA.tb_new
+    sel = sqlselect([tb_items.c.thumb, ]).distinct() \
+        .where(directory_range(tb_items.c.path, str_directory))
+    result = GLOBAL_DATA.db_conn.execute(sel)
+    thumbs = [row[0] for row in result.fetchall() if row[0]]
+    result.close()
+
+    with GLOBAL_DATA.db_conn.begin():
+        result = GLOBAL_DATA.db_conn.execute(
+            tb_items.delete(None).where(directory_range(tb_items.c.path, str_directory)))
+        deleted = result.rowcount
+        GLOBAL_DATA.db_conn.execute(
+            tb_new.delete(None).where(directory_range(tb_new.c.path, str_directory)))
+    GLOBAL_DATA.updates_browse_list = True
+    release_thumbs(thumbs)
+    LOG.info('Deleted directory %s, %d items', str_directory, deleted)
+
+
+class PendingEvent:
+    """the net change waiting to be applied to one path, see EventCoalescer"""
+    __slots__ = ('action', 'source', 'modified', 'deadline')
+
+    def __init__(self, action, deadline, source=None, modified=False):
+        # 'add', 'modified', 'delete', 'moved' (here, from source) or 'rescan' (a directory)
+        self.action = action
+        self.source = source  # for 'moved', the path the database knows the item by
+        self.modified = modified  # for 'moved', contents changed too
+        self.deadline = deadline  # time to apply it, if nothing else happens to the path
+
+
+class EventCoalescer:
+    """
+    Holds filesystem monitor events until FILESYSTEM_EVENT_DELAY seconds after the last one
+    for a path, folding each new event into the net change for that path - a per-path state
+    in a dict, plus a heap of deadlines. Create, modify, modify, delete comes out as nothing
+    at all; a run of modifies as one; create then move as a create at the destination; a
+    move of a moved file as one move from the original path. Each event is a dict lookup
+    and a heap push, however many paths are pending.
+
+    Directory moves and deletes aren't held - they go straight on to directory_changes, to
+    be applied in bulk (move_directory, delete_directory) ahead of the per-path changes,
+    which are rewritten to match. The per-file events some platforms send along with a
+    directory move are recognised and dropped.
+
+    Events are also counted against each directory above the path. A subtree getting more
+    than STORM_EVENTS in STORM_WINDOW seconds is in a storm: its pending changes are
+    dropped for a single 'rescan' of the subtree, and further events there just push the
+    rescan back, until things are quiet for the delay.
+    """
+
+    def __init__(self, delay=FILESYSTEM_EVENT_DELAY):
+        self.delay = delay
+        self.pending = dict()  # path -> PendingEvent
+        self.deadlines = list()  # heap of (deadline, sequence, path), may hold stale entries
+        self.sequence = itertools.count()
+        self.directory_changes = list()  # ('dir-moved', src, dest) or ('dir-delete', src, None)
+        self.moved_directories = list()  # (src, dest, until) - recent moves, for their echoes
+        self.event_counts = defaultdict(int)  # directory -> events this window
+        self.window_start = time.time()
+        self.storms = set()  # directories waiting on a rescan
+
+    @staticmethod
+    def within(path, directory):
+        """True if path is directory or somewhere inside it"""
+        return path == directory or path.startswith(directory + os.sep)
+
+    def storm_for(self, path):
+        """the storming directory path is in, None if there isn't one"""
+        if not self.storms:
+            return None
+        parts = path.split(os.sep)
+        for depth in range(1, len(parts)):
+            directory = os.sep.join(parts[:depth])
+            if directory in self.storms:
+                return directory
+        return None
+
+    def count_event(self, path):
+        """
+        Count an event against each directory above path. Returns the deepest of those now
+        over the storm threshold, or None.
+        """
+        now = time.time()
+        if now - self.window_start > STORM_WINDOW:
+            self.event_counts.clear()
+            self.window_start = now
+        parts = path.split(os.sep)
+        storming = None
+        for depth in range(1, len(parts)):
+            directory = os.sep.join(parts[:depth])
+            self.event_counts[directory] += 1
+            if self.event_counts[directory] > STORM_EVENTS:
+                storming = directory
+        return storming
+
+    def start_storm(self, directory):
+        """switch a directory over to one rescan, in place of everything pending below it"""
+        LOG.info('Event storm in %s, it will be rescanned once things settle', directory)
+        for path, pending in list(self.pending.items()):
+            if self.within(path, directory):
+                del self.pending[path]
+                if pending.action == 'rescan':
+                    self.storms.discard(path)
+                elif pending.action == 'moved' and not self.within(pending.source, directory):
+                    # moved in from outside - the database has it at source still
+                    self.source_gone(pending.source, pending.deadline)
+        self.storms.add(directory)
+        self.set(directory, PendingEvent('rescan', time.time() + self.delay))
+
+    def storm_event(self, directory):
+        """another event in a storm - hold off the rescan a while longer"""
+        pending = self.pending[directory]
+        pending.deadline = time.time() + self.delay
+        self.set(directory, pending)
+
+    @staticmethod
+    def below(path, directory):
+        """True if path is somewhere inside directory"""
+        return path.startswith(directory + os.sep)
+
+    def directory_event(self, action, src, dest=None):
+        """a whole directory moved or went away - queue the bulk change, adjust pending ones"""
+        if action == 'dir-moved' and self.echoes_directory_move(src, dest):
+            return  # a subdirectory of one already moved
+        self.directory_changes.append((action, src, dest))
+        now = time.time()
+        if action == 'dir-moved':
+            self.moved_directories = [moved for moved in self.moved_directories
+                                      if moved[2] > now]
+            # the echoes come straight after, but allow for a busy moment
+            self.moved_directories.append((src, dest, now + max(self.delay, 10)))
+            # the bulk move happens first, so pending changes at or below src now belong
+            # there under dest - including a storm's rescan, which is keyed at the directory
+            def rebase(path):
+                return dest + path[len(src):] if self.within(path, src) else path
+
+            for path, pending in list(self.pending.items()):
+                if pending.source is not None:
+                    pending.source = rebase(pending.source)
+                if self.within(path, src):
+                    del self.pending[path]
+                    self.set(rebase(path), pending)
+            self.storms = {rebase(directory) for directory in self.storms}
+        else:
+            for path, pending in list(self.pending.items()):
+                if self.within(path, src):
+                    del self.pending[path]
+                    if pending.action == 'moved' and not self.below(pending.source, src):
+                        # moved in, then deleted along with the directory
+                        self.source_gone(pending.source, pending.deadline)
+            self.storms = {directory for directory in self.storms
+                           if not self.within(directory, src)}
+
+    def echoes_directory_move(self, src, dest):
+        """True if a file move is just part of a directory move already queued"""
+        for moved_src, moved_dest, until in self.moved_directories:
+            if self.below(src, moved_src) and dest == moved_dest + src[len(moved_src):]:
+                return until > time.time()
+        return False
+
+    def pop_directory_changes(self):
+        """take the directory changes waiting to be applied, oldest first"""
+        changes = self.directory_changes
+        self.directory_changes = list()
+        return changes
+
+    def __len__(self):
+        return len(self.pending)
+
+    def set(self, path, pending):
+        """record the net change for path, due after the delay"""
+        self.pending[path] = pending
+        heapq.heappush(self.deadlines, (pending.deadline, next(self.sequence), path))
+        # superseded deadlines are skipped when they come up, but don't let them pile up
+        if len(self.deadlines) > 2 * len(self.pending) + 1000:
+            self.deadlines = [(item.deadline, next(self.sequence), item_path)
+                              for item_path, item in self.pending.items()]
+            heapq.heapify(self.deadlines)
+
+    def source_gone(self, source, deadline):
+        """
+        A moved file is gone for good, so the item the database still has at its original
+        path has to go - folded into whatever is pending there now, e.g. a new file created
+        at that path since is a changed item, not a new one.
+        """
+        current = self.pending.get(source)
+        if current is None:
+            self.set(source, PendingEvent('delete', deadline))
+        elif current.action == 'add':
+            self.set(source, PendingEvent('modified', max(deadline, current.deadline)))
+        else:
+            current.deadline = max(deadline, current.deadline)
+            self.set(source, current)
+
+    def event(self, action, src, dest=None):
+        """fold one event from the filesystem monitor into the pending changes"""
+        if action in ('dir-moved', 'dir-delete'):
+            self.directory_event(action, src, dest)
+            return
+        if action == 'moved' and self.echoes_directory_move(src, dest):
+            return
+
+        # in a storm, the rescan will pick it up
+        storming = self.count_event(src)
+        if storming is not None and storming not in self.storms \
+                and self.storm_for(storming) is None:
+            self.start_storm(storming)
+        storm = self.storm_for(src)
+        if storm is not None:
+            self.storm_event(storm)
+            if action != 'moved' or self.storm_for(dest) is not None:
+                return
+            # moved out of the storm, what arrives at dest is new as far as we know
+            action, src = 'add', dest
+        elif action == 'moved' and self.storm_for(dest) is not None:
+            # moved into the storm - the rescan finds it, here it's just gone
+            self.storm_event(self.storm_for(dest))
+            action = 'delete'
+
+        deadline = time.time() + self.delay
+        current = self.pending.get(src)
+
+        if action == 'add':
+            if current is None or current.action == 'add':
+                self.set(src, PendingEvent('add', deadline))
+            elif current.action == 'delete':
+                # deleted and created again - the database still has it, maybe changed
+                self.set(src, PendingEvent('modified', deadline))
             else:
-                # no match for path or hash, this is a new file, so add it
-                add_item(pathname, shahash)
-    else:
-        # there was no existing data, so just add this
-        add_item(pathname, get_hash(pathname))
+                current.deadline = deadline
+                self.set(src, current)
+
+        elif action == 'modified':
+            if current is None:
+                self.set(src, PendingEvent('modified', deadline))
+            elif current.action == 'delete':
+                pass  # can't be, it's gone
+            else:
+                current.modified = True  # only matters for a move
+                current.deadline = deadline
+                self.set(src, current)
+
+        elif action == 'delete':
+            if current is None or current.action == 'modified':
+                self.set(src, PendingEvent('delete', deadline))
+            elif current.action == 'add':
+                del self.pending[src]  # came and went, the database never needs to know
+            elif current.action == 'moved':
+                # it's the item at the original path that's gone
+                del self.pending[src]
+                self.source_gone(current.source, deadline)
+
+        elif action == 'moved':
+            self.pending.pop(src, None)  # nothing is left at src
+            if current is None or current.action == 'delete':
+                self.set(dest, PendingEvent('moved', deadline, source=src))
+            elif current.action == 'add':
+                self.set(dest, PendingEvent('add', deadline))
+            elif current.action == 'modified':
+                self.set(dest, PendingEvent('moved', deadline, source=src, modified=True))
+            elif current.source == dest:
+                # moved back where it started
+                if current.modified:
+                    self.set(dest, PendingEvent('modified', deadline))
+                else:
+                    self.pending.pop(dest, None)
+            else:
+                self.set(dest, PendingEvent('moved', deadline, source=current.source,
+                                            modified=current.modified))
+
+    def next_deadline(self):
+        """when the earliest pending change is due, None if there are none"""
+        while self.deadlines:
+            deadline, _, path = self.deadlines[0]
+            pending = self.pending.get(path)
+            if pending is not None and pending.deadline == deadline:
+                return deadline
+            heapq.heappop(self.deadlines)  # stale
+        return None
+
+    def pop_due_batch(self, limit, now=None):
+        """take up to limit changes that are due, earliest first"""
+        if now is None:
+            now = time.time()
+        batch = list()
+        while len(batch) < limit:
+            due = self.pop_due(now)
+            if due is None:
+                break
+            batch.append(due)
+        return batch
+
+    def pop_due(self, now=None):
+        """take the earliest change if it is due - (path, PendingEvent) or None"""
+        if now is None:
+            now = time.time()
+        deadline = self.next_deadline()
+        if deadline is None or deadline > now:
+            return None
+        _, _, path = heapq.heappop(self.deadlines)
+        self.storms.discard(path)  # if it was a rescan, events from here on count afresh
+        return path, self.pending.pop(path)
 
 
-def found_create(qlist, queue_entry):
-    """helper for monitor_queue (from filesystem monitor) """
-    src = queue_entry['src']
-    # my most complex list comprehension follows
-    result = [True for alpha in qlist if alpha['src'] == src and alpha['action'] == 'add']
-    # tests for the list to be not empty and the first item is True
-    return result and result[0]
+def apply_directory_change(action, src, dest):
+    """make the database match a directory move or delete, from EventCoalescer"""
+    LOG.info('Applying filesystem change: %s, path: %s', action, src)
+    if action == 'dir-moved':
+        move_directory(src, dest)
+    elif action == 'dir-delete':
+        delete_directory(src)
+
+
+def apply_file_event(path, pending, released):
+    """
+    make the database match the net change to a path, from EventCoalescer. Previews let go
+    of are added to released, to be released once the change has been committed.
+    """
+    LOG.info('Applying filesystem change: %s, path: %s', pending.action, path)
+    pathname = Path(path)
+    if pending.action == 'add':
+        if not search_path(pathname):
+            add_item(pathname)
+        else:
+            # replaced, e.g. an editor saving via a temp file
+            update_item_hash_thumb(pathname, released=released)
+    elif pending.action == 'delete':
+        delete_item(pathname, released)
+    elif pending.action == 'modified':
+        update_item_hash_thumb(pathname, released=released)
+    elif pending.action == 'moved':
+        if not search_path(Path(pending.source)):
+            # never made it into the database, so it's new here
+            apply_file_event(path, PendingEvent('add', pending.deadline), released)
+            return
+        if search_path(pathname):
+            delete_item(pathname, released)  # moved over the top of another item
+        update_item_path(Path(pending.source), pathname)
+        if pending.modified:
+            update_item_hash_thumb(pathname, released=released)
 
 
 def monitor_filesystem():
@@ -601,6 +1615,217 @@ def monitor_filesystem():
     GLOBAL_DATA.observer.start()
 
 
+def db_edit(edit, timeout=150):
+    """
+    For the web UI threads: have the main thread, which owns the database connection, run
+    edit(connection) - every statement of one logical edit, reads included - inside a
+    transaction, and wait for whatever edit returns. Edits that pile up while the main
+    thread is busy are committed together, see answer_gui_edits. Each call gets its own
+    Future to wait on, so concurrent requests can't get each other's results.
+    """
+    reply = concurrent.futures.Future()
+    QUEUE.put({'type': 'edit', 'edit': edit, 'reply': reply})
+    # a longer timeout, cause we're not handling it if it expires
+    return reply.result(timeout)
+
+
+def db_read(statement):
+    """
+    For the web UI threads: run a read-only statement right here, on one of the pooled
+    read connections, and return {'rows': [...]}. With WAL journaling this sees
+    everything committed so far, and doesn't wait on the main thread at all.
+    """
+    with GLOBAL_DATA.read_engine.connect() as read_conn:
+        result = read_conn.execute(statement)
+        rows = result.fetchall()
+        result.close()
+    return {'rows': rows}
+
+
+def answer_gui_edits(queue_entries):
+    """
+    Group commit: run a run of queued web UI edits in one transaction, so edits that arrive
+    together (several pages, or clicks faster than the main thread gets round to them) share
+    a commit. A bulk action is a single edit anyway, see bulk_labels. Each edit's result goes
+    back to its waiting request once the commit is done. If any edit fails the whole group
+    is rolled back and run again one edit per transaction, so only the bad one fails.
+    """
+    transaction = GLOBAL_DATA.db_conn.begin()
+    try:
+        results = [queue_entry['edit'](GLOBAL_DATA.db_conn) for queue_entry in queue_entries]
+        transaction.commit()
+    except Exception as exception_info:
+        transaction.rollback()
+        if len(queue_entries) > 1:
+            for queue_entry in queue_entries:
+                answer_gui_edits([queue_entry])
+            return
+        LOG.error('Web UI edit failed: %s', exception_info)
+        queue_entries[0]['reply'].set_exception(exception_info)
+        return
+    for queue_entry, result in zip(queue_entries, results):
+        queue_entry['reply'].set_result(result)
+
+
+def drain_queue(execute_queue_task, queue_entry=None):
+    """
+    Hand queue_entry (if given, already taken off the QUEUE) and then everything else on the
+    QUEUE to execute_queue_task, one entry at a time - except web UI edits, which are
+    gathered up (EDIT_GROUP_SIZE at most) and committed together. A group is flushed before
+    anything else is handled, so the order of the queue is kept.
+    """
+    edits = list()
+
+    def flush_edits():
+        answer_gui_edits(edits)
+        for _ in edits:
+            QUEUE.task_done()
+        edits.clear()
+
+    if queue_entry is None and not QUEUE.empty():
+        queue_entry = QUEUE.get_nowait()
+    while queue_entry is not None:
+        if queue_entry['type'] == 'edit':
+            edits.append(queue_entry)
+            if len(edits) >= EDIT_GROUP_SIZE:
+                flush_edits()
+        else:
+            if edits:
+                flush_edits()
+            execute_queue_task(queue_entry)
+        queue_entry = QUEUE.get_nowait() if not QUEUE.empty() else None
+    if edits:
+        flush_edits()
+
+
+def service_gui_queue():
+    """
+    Used by the initial scan, before monitor_queue takes over: answer whatever the web UI
+    and the preview workers have put on the QUEUE. The filesystem monitor doesn't start
+    until the scan is done, so nothing else shows up yet.
+    """
+    def execute_queue_task(queue_entry):
+        if queue_entry['type'] == 'preview':
+            update_item_thumb(queue_entry['thumb'], queue_entry['result'])
+        QUEUE.task_done()
+
+    drain_queue(execute_queue_task)
+
+
+class ThumbnailSweeper:
+    """
+    Garbage collector for the thumbnail directory. Previews left behind by crashes, --clear
+    runs and failed updates aren't referenced by any item but stay on disk. This walks the
+    directory and removes them, incrementally: each step() looks at one batch of files,
+    checks them against the thumb column in one query, and removes at most a few
+    unreferenced ones, so it never holds up the main loop for long. Scaled copies
+    (<hash>-<size>.<ext>) belong to their full size preview.
+    """
+
+    def __init__(self):
+        self.entries = None  # generator over the current pass, None between passes
+        self.doomed = list()  # (thumb, relative path, size) found unreferenced, to remove
+        self.next_step = 0
+        self.reclaimed_files = 0
+        self.reclaimed_bytes = 0
+        # carry on the schedule from the last run
+        last_pass = float(get_mdata('thumbnail_gc_last_pass', 0))
+        self.next_pass = last_pass + THUMBNAIL_GC_PERIOD
+
+    @staticmethod
+    def thumbnail_files():
+        """(relative path, size, mtime) of every file in the thumbnail directory, one level deep"""
+        if not THUMBNAIL_DIRECTORY.exists():
+            return
+        with os.scandir(str(THUMBNAIL_DIRECTORY)) as top_entries:
+            top_entries = list(top_entries)
+        for top_entry in top_entries:
+            try:
+                if top_entry.is_file(follow_symlinks=False):
+                    stat = top_entry.stat(follow_symlinks=False)
+                    yield top_entry.name, stat.st_size, stat.st_mtime
+                elif top_entry.is_dir(follow_symlinks=False):
+                    with os.scandir(top_entry.path) as entries:
+                        for entry in entries:
+                            if entry.is_file(follow_symlinks=False):
+                                stat = entry.stat(follow_symlinks=False)
+                                yield f'{top_entry.name}/{entry.name}', stat.st_size, stat.st_mtime
+            except FileNotFoundError:
+                continue  # removed while we were looking
+
+    @staticmethod
+    def owning_thumb(relative_path):
+        """the thumb column value that keeps this file alive, None if nothing can"""
+        directory, _, name = relative_path.rpartition('/')
+        if name.endswith('.partial'):
+            return None  # left by an interrupted write
+        stem = name.split('.')[0]
+        if directory and '-' in stem:
+            stem = stem.split('-')[0]  # a scaled copy
+            name = stem + '.jpeg'
+        return f'{directory}/{name}' if directory else name
+
+    def next_time(self):
+        """when step() will next have something to do"""
+        if self.entries is None and not self.doomed:
+            return max(self.next_pass, self.next_step)
+        return self.next_step
+
+    def step(self):
+        """do one bounded piece of sweeping, if it is time to"""
+        now = time.time()
+        if now < self.next_step:
+            return
+        self.next_step = now + THUMBNAIL_GC_INTERVAL
+
+        if self.entries is None:
+            if now < self.next_pass:
+                return
+            LOG.info('Starting thumbnail garbage collection pass')
+            self.entries = self.thumbnail_files()
+            self.reclaimed_files = self.reclaimed_bytes = 0
+
+        if not self.doomed:
+            batch = list(itertools.islice(self.entries, THUMBNAIL_GC_BATCH))
+            if not batch:
+                self.finish_pass(now)
+                return
+            old_files = [(self.owning_thumb(relative_path), relative_path, size)
+                         for relative_path, size, mtime in batch
+                         if now - mtime > THUMBNAIL_GC_MIN_AGE]
+            if not old_files:
+                return
+            in_use = referenced_thumbs({thumb for thumb, _, _ in old_files})
+            self.doomed = [old_file for old_file in old_files if old_file[0] not in in_use]
+
+        removing = self.doomed[:THUMBNAIL_GC_DELETES]
+        self.doomed = self.doomed[THUMBNAIL_GC_DELETES:]
+        # check again, an item may have picked one up since the batch was looked at
+        in_use = referenced_thumbs({thumb for thumb, _, _ in removing})
+        for thumb, relative_path, size in removing:
+            if thumb in in_use:
+                continue
+            try:
+                THUMBNAIL_DIRECTORY.joinpath(relative_path).unlink()
+            except FileNotFoundError:
+                continue
+            self.reclaimed_files += 1
+            self.reclaimed_bytes += size
+
+    def finish_pass(self, now):
+        """the whole directory has been looked at - report, and schedule the next pass"""
+        self.entries = None
+        self.next_pass = now + THUMBNAIL_GC_PERIOD
+        set_mdata({'thumbnail_gc_last_pass': now,
+                   'thumbnail_gc_reclaimed_files': self.reclaimed_files,
+                   'thumbnail_gc_reclaimed_bytes': self.reclaimed_bytes})
+        LOG.info('Thumbnail garbage collection removed %d files, reclaimed %.1f MB',
+                 self.reclaimed_files, self.reclaimed_bytes / 1e6)
+        if self.reclaimed_files:
+            print(f'Removed {self.reclaimed_files} unused thumbnails, '
+                  f'reclaimed {self.reclaimed_bytes / 1e6:.1f} MB')
+
+
 def monitor_queue():
     """
     We have two separate threads: 1) running the file system monitor and 2) running the bottle
@@ -610,77 +1835,104 @@ def monitor_queue():
 
     # The complexity here is almost entirely driven by the events coming from the
     # file system monitor. The file system monitor is too noisy, sending events that are not
-    # interesting, like a create event and 12 modify events. To avoid extra work, buffer these
-    # events for 15 seconds. Also a create followed by modified are combined into one create.
-    # When a event arrives, it is first inspected to see if it is a modified following
-    # a create, and if so, it is dropped. Otherwise it is added to a queue with a timestamp
-    # of 15 seconds into the future. We then monitor the queue to see if the top event's
-    # time is up. If it is, then that event is processed. Think of it as one queue feeding
+    # interesting, like a create event and 12 modify events. To avoid extra work, events are
+    # held in an EventCoalescer, which folds them into one net change per path and holds
+    # that until 15 seconds after the path's last event. Think of it as one queue feeding
     # another queue, and that other one has a time buffer on it.
-
-    qlist = list()
-    queue_delay = 15  # seconds
-    time_counter = 0
+    #
+    # The loop sleeps in QUEUE.get() until either something arrives or the next change (or
+    # thumbnail sweep) is due. Due changes are applied FILESYSTEM_EVENT_BATCH at a time, one
+    # transaction each, and the QUEUE is checked between batches, so an edit from the web UI
+    # waits for one batch at most. Edits that arrive together are committed together.
+
+    coalescer = EventCoalescer()
+    sweeper = ThumbnailSweeper()  # cleans up unused thumbnails when there's nothing else to do
+
+    def execute_queue_task(queue_entry):
+        if queue_entry['type'] == 'filesystem-monitor':
+            execute_queue_task_file(queue_entry)
+        elif queue_entry['type'] == 'preview':
+            execute_queue_task_preview(queue_entry)
+        elif queue_entry['type'] == 'verify':
+            verify_item_hash(queue_entry['path'], queue_entry['shahash'], queue_entry['stat'])
+        QUEUE.task_done()
 
     def execute_queue_task_file(queue_entry):
         LOG.info("Dequeued filesystem event: %s, src: %s",
                  queue_entry['action'], queue_entry['src'])
-        # squash modified events right after create
-        if queue_entry['action'] == 'modified' \
-                and found_create(qlist, queue_entry):
-            pass  # squash
-        else:
-            queue_entry['timestamp'] = time.time() + queue_delay
-            qlist.append(queue_entry)  # add to second queue
-
-    def execute_queue_task_gui(queue_entry):
-        # run the provided query and return the results on the results queue
-        result = GLOBAL_DATA.db_conn.execute(queue_entry['select'])
-        if result is not None:
-            try:
-                RESULTSQ.put({'rows': result.fetchall()})
-                result.close()
-            except:
-                RESULTSQ.put({'rows': None})
-        else:
-            RESULTSQ.put({'rows': None})
-
-    def execute_queue_task_delayed():
-        queue_entry = qlist.pop(0)
-        action = queue_entry['action']
-        src = queue_entry['src']
-        LOG.info("popped from secondary queue: action: %s, src: %s", action, src)
-        if action == 'add':
-            add_item(Path(src))
-        if action == 'delete':
-            delete_item(Path(src))
-        if action == 'modified':
-            update_item_hash_thumb(Path(src))
-        if action == 'moved':
-            update_item_path(Path(src), Path(queue_entry['dest']))
-
+        coalescer.event(queue_entry['action'], queue_entry['src'], queue_entry.get('dest'))
+
+    def execute_queue_task_preview(queue_entry):
+        update_item_thumb(queue_entry['thumb'], queue_entry['result'])
+
+    def execute_queue_tasks():
+        drain_queue(execute_queue_task)
+
+    def execute_due_changes(due):
+        # a storm's rescan commits as it goes, and keeps the QUEUE moving meanwhile
+        for path, pending in due:
+            if pending.action == 'rescan':
+                try:
+                    rescan_directory(path, execute_queue_tasks)
+                except Exception:
+                    LOG.exception('Could not rescan %s', path)
+        due = [(path, pending) for path, pending in due if pending.action != 'rescan']
+        if not due:
+            return
+        apply_file_events(due)
+
+    def apply_file_events(due):
+        # one transaction for the lot. If one change fails, the lot is rolled back and
+        # applied again one change per transaction, so only the bad one is lost. Previews
+        # are only released once the changes letting go of them are committed.
+        released = list()
+        transaction = GLOBAL_DATA.db_conn.begin()
+        try:
+            for path, pending in due:
+                apply_file_event(path, pending, released)
+            transaction.commit()
+        except Exception:
+            transaction.rollback()
+            if len(due) > 1:
+                for change in due:
+                    apply_file_events([change])
+                return
+            LOG.exception('Could not apply filesystem change: %s', due[0][0])
+            return
+        GLOBAL_DATA.updates_browse_list = True
+        release_thumbs(released)
+
+    def time_to_wait():
+        # until the next change or sweep is due - but wake up now and then regardless
+        if coalescer.directory_changes:
+            return 0
+        wake_up = sweeper.next_time()
+        deadline = coalescer.next_deadline()
+        if deadline is not None:
+            wake_up = min(wake_up, deadline)
+        return min(max(wake_up - time.time(), 0), 5.0)
 
-    # pylint: disable=misplaced-comparison-constant
     try:
         while True:
-            time.sleep(0.1) # need to speed this up because the UI is waiting.
-            while not QUEUE.empty():
-                queue_entry = QUEUE.get_nowait()
-                if queue_entry['type'] == 'filesystem-monitor':
-                    execute_queue_task_file(queue_entry)
-                elif queue_entry['type'] == 'gui':
-                    execute_queue_task_gui(queue_entry)
-                QUEUE.task_done()
-
-            # now process events from the secondary queue whose time is up,
-            # but only do 1 each 1 second of loop iteration
-            # in order to not consume too much time, impacting GUI
-            if qlist and time.time() > qlist[0]['timestamp']:
-                execute_queue_task_delayed()
-            # done, back to sleep
-            time_counter += 1
-            if time_counter > 9:
-                time_counter = 0
+            try:
+                drain_queue(execute_queue_task, QUEUE.get(timeout=time_to_wait()))
+            except queue.Empty:
+                pass
+
+            # directory moves and deletes first, each in bulk
+            for change in coalescer.pop_directory_changes():
+                try:
+                    apply_directory_change(*change)
+                except Exception:
+                    LOG.exception('Could not apply directory change: %s', change)
+
+            # now apply the changes from the coalescer whose time is up, one batch, then
+            # back round to the QUEUE in case the web UI wants something
+            due = coalescer.pop_due_batch(FILESYSTEM_EVENT_BATCH)
+            if due:
+                execute_due_changes(due)
+            elif QUEUE.empty():
+                sweeper.step()
 
     except KeyboardInterrupt:
         GLOBAL_DATA.observer.stop()
@@ -688,47 +1940,515 @@ def monitor_queue():
     GLOBAL_DATA.observer.join()  # wait for observer thread to exit
 
 
-def walk_directory_tree(directory):
-    """inspect every item in the directory tree, add if it is missing"""
-    for filesystem_item in directory.iterdir():
-        pathname = Path(filesystem_item)
-        if pathname.is_dir():  # if directory, descend into it now unless excluded
-            if pathname not in IGNORED_DIRECTORIES:
-                walk_directory_tree(pathname)
-        elif pathname.is_file():  # if regular file, check and add it if required.
-            # find the extension and if on an exclude list, just return
-            if pathname.suffix in EXCLUDE_EXTENSIONS:
+class ScanReconciler:
+    """
+    Brings the database in line with the directory tree at startup. Files streamed from the
+    directory walk are diffed against a snapshot (what the database knew about each path,
+    loaded in one query by load_snapshot) instead of being looked up one by one:
+      - a known path with the same size, mtime and inode is unchanged, nothing to read
+      - a known path with different stat values is rehashed, and updated if the hash changed
+      - an unknown path is new, unless its fingerprint or hash matches something the
+        database already has - then it may be a moved item, settled once the walk is done
+      - whatever is left in the snapshot after the walk was deleted, or moved away
+    Hashing runs in a pool of worker processes or threads, and the results are reconciled
+    here (the database thread) in the order they complete. With zero workers, hashing is
+    done inline. All writes go through an IngestBatch.
+
+    Each scan is a numbered generation. Progress is checkpointed in the mdata table at
+    directory boundaries, so a scan that gets killed picks up where it left off. Deletions
+    are only settled once a generation has seen the whole tree.
+
+    Given a directory, it reconciles just that subtree (see rescan_directory) - no
+    generations or checkpoints, and the initial scan's progress report is left alone.
+    """
+
+    def __init__(self, workers=HASH_WORKERS, pool_type=HASH_POOL_TYPE, verify=False,
+                 batch_size=INGEST_BATCH_SIZE, directory=None):
+        self.verify = verify  # rehash everything, even when the stat values say unchanged
+        self.directory = directory
+        self.batch = IngestBatch(batch_size)
+        # paths are popped off as they are found
+        self.snapshot = load_snapshot(directory)
+        # contents the database already has - a new path matching one of these may be a move
+        self.known_fingerprints = {entry.fingerprint for entry in self.snapshot.values()
+                                   if entry.fingerprint}
+        self.known_hashes = {entry.shahash for entry in self.snapshot.values()}
+        self.maybe_moved = list()  # (pathname, stat, fingerprint, shahash or None)
+        self.unverified = list()  # (pathname, stat) - moves taken on the fingerprint alone
+        self.counts = dict(unchanged=0, modified=0, added=0, moved=0, deleted=0)
+        # what /scan_status reports while this runs
+        self.status = dict(state='scanning', started=time.time(), files=0,
+                           known=len(self.snapshot), directory='', counts=self.counts)
+        if directory is None:
+            GLOBAL_DATA.scan_status = self.status
+
+        if workers is None:
+            workers = os.cpu_count() or 1
+        self.pool = None
+        if workers > 0:
+            if pool_type == 'thread':
+                self.pool = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+            else:
+                # the web UI and preview threads are already running, don't fork them
+                self.pool = concurrent.futures.ProcessPoolExecutor(
+                    max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+        # keep the pool busy, but don't let the walk race too far ahead of it
+        self.max_pending = 4 * max(workers, 1)
+        self.pending = dict()  # future -> (pathname, stat, known, fingerprint)
+
+        self.generation = 0
+        self.resume_after = None  # directory the interrupted scan had completed up to
+        self.last_checkpoint = time.time()
+
+    def start_generation(self):
+        """pick up an interrupted scan from its checkpoint, or start a new generation"""
+        self.generation = int(get_mdata('scan_generation', 0))
+        if get_mdata('scan_state') == 'running' and not self.verify:
+            self.resume_after = get_mdata('scan_last_dir') or None
+            self.counts.update(json.loads(get_mdata('scan_counts', '{}')))
+            LOG.info('Resuming scan generation %d after directory %s',
+                     self.generation, self.resume_after)
+        else:
+            self.generation += 1
+            LOG.info('Starting scan generation %d', self.generation)
+        set_mdata({'scan_generation': self.generation, 'scan_state': 'running'})
+
+    def resumed_past(self, pathname):
+        """
+        Helper while resuming - True if this file is in a directory the interrupted scan
+        already finished. The walk goes in sorted depth-first order, which is the order of the
+        directories' path parts, so that is just a comparison against the checkpoint.
+        """
+        if self.resume_after is None:
+            return False
+        if pathname.parent.parts <= Path(self.resume_after).parts:
+            return True
+        self.resume_after = None  # past the checkpoint, back to normal scanning
+        return False
+
+    def file_already_seen(self, pathname):
+        """
+        A file in an already finished directory - if the database has it, it was reconciled
+        before the interruption, so just mark it found. Otherwise it still needs the full
+        treatment (e.g. a possible move that hadn't been settled yet).
+        """
+        if self.snapshot.pop(str(pathname), None) is None:
+            self.file_found(pathname)
+        else:
+            self.status['files'] += 1
+
+    def directory_done(self, directory):
+        """
+        The walk has moved past a directory. Every so often, make sure all its files are
+        reconciled and commit them together with a checkpoint naming that directory.
+        """
+        self.status['directory'] = directory
+        if self.resume_after is not None \
+                or time.time() - self.last_checkpoint < SCAN_CHECKPOINT_SECONDS:
+            return
+        self.reconcile()
+        set_mdata({'scan_last_dir': directory, 'scan_counts': json.dumps(self.counts)},
+                  self.batch)
+        self.batch.flush()
+        self.last_checkpoint = time.time()
+        LOG.info('Scan checkpoint after directory %s', directory)
+
+    def file_found(self, pathname, entry=None):
+        """classify one file from the directory walk"""
+        self.status['files'] += 1
+        try:
+            if entry is None:
+                stat = get_stat(pathname)
+            else:
+                # the DirEntry from the walk may already have the stat values cached,
+                # except on Windows where its inode is always 0
+                stat_result = entry.stat()
+                if stat_result.st_ino:
+                    stat = stat_result.st_size, stat_result.st_mtime_ns, stat_result.st_ino
+                else:
+                    stat = get_stat(pathname)
+        except OSError:
+            LOG.info('File has disappeared: %s', pathname)
+            return
+        self.batch.flush_if_due()
+
+        known = self.snapshot.pop(str(pathname), None)
+        try:
+            if known is not None:
+                if not self.verify and known[:3] == stat:
+                    self.counts['unchanged'] += 1
+                    if known.fingerprint is None:  # recorded before fingerprints, fill it in
+                        update_item_fingerprint(pathname, get_fingerprint(pathname, stat[0]),
+                                                self.batch)
+                    return
+                self.hash_file(pathname, stat, known)
+                return
+
+            fingerprint = get_fingerprint(pathname, stat[0])
+        except OSError:
+            LOG.info('File has disappeared: %s', pathname)
+            return
+        if fingerprint in self.known_fingerprints and not self.verify:
+            # looks like something already in the database, can't tell if it moved
+            # until the whole tree has been seen. (With verify, it gets the full hash
+            # first, and a matching hash brings it back here.)
+            self.maybe_moved.append((pathname, stat, fingerprint, None))
+            return
+        self.hash_file(pathname, stat, None, fingerprint)
+
+    def hash_file(self, pathname, stat, known=None, fingerprint=None):
+        """get the full hash of a file, in the pool when there is one"""
+        if self.pool is None:
+            try:
+                shahash = get_hash(pathname)
+            except OSError:
+                LOG.info('File has disappeared: %s', pathname)
                 return
-            add_if_missing(pathname)
+            self.hashed(pathname, stat, known, fingerprint, shahash)
+            return
+
+        self.pending[self.pool.submit(get_hash, pathname)] = (pathname, stat, known, fingerprint)
+        if len(self.pending) >= self.max_pending:
+            self.reconcile(concurrent.futures.FIRST_COMPLETED)
+
+    def reconcile(self, return_when=concurrent.futures.ALL_COMPLETED):
+        """wait for hashes to finish and bring the database up to date with them"""
+        if not self.pending:
+            return
+        done, _ = concurrent.futures.wait(self.pending, return_when=return_when)
+        for future in done:
+            pathname, stat, known, fingerprint = self.pending.pop(future)
+            try:
+                shahash = future.result()
+            except OSError:
+                # file went away between discovery and hashing
+                LOG.info('File has disappeared: %s', pathname)
+                continue
+            self.hashed(pathname, stat, known, fingerprint, shahash)
+
+    def hashed(self, pathname, stat, known, fingerprint, shahash):
+        """a file's full hash is in, decide what to do with it"""
+        if known is not None:
+            if shahash == known.shahash:
+                # same contents, just make sure the stat values are current
+                self.counts['unchanged'] += 1
+                if known[:3] != stat:
+                    update_item_stat(pathname, stat, self.batch)
+            else:
+                self.counts['modified'] += 1
+                update_item_hash_thumb(pathname, shahash, stat, self.batch)
+        elif shahash in self.known_hashes:
+            self.maybe_moved.append((pathname, stat, fingerprint, shahash))
         else:
-            LOG.info(f'skipping: %s - what is this anyway?', pathname)
+            self.counts['added'] += 1
+            add_item(pathname, shahash, stat, self.batch, fingerprint)
+
+    def settle_moves(self):
+        """
+        After the walk, the snapshot holds only the paths that were not found. Match the
+        possible moves against those: same fingerprint plus same size, mtime and inode is
+        taken as the move straight away, so a moved folder of big files isn't read through
+        again - its full hash is checked in the background afterwards, see HashVerifier.
+        Failing that, it comes down to the same full hash. Anything unmatched is a new item
+        (e.g. a duplicate copy).
+        """
+        leftover_fingerprints = defaultdict(list)
+        leftover_hashes = defaultdict(list)
+        for str_pathname, entry in self.snapshot.items():
+            if entry.fingerprint:
+                leftover_fingerprints[entry.fingerprint].append(str_pathname)
+            leftover_hashes[entry.shahash].append(str_pathname)
+
+        def take(candidates, matches=lambda entry: True):
+            """pop the first candidate still left over that passes the check"""
+            for str_pathname in candidates:
+                entry = self.snapshot.get(str_pathname)
+                if entry is not None and matches(entry):
+                    del self.snapshot[str_pathname]
+                    return str_pathname
+            return None
+
+        moves = list()
+        need_hash = list()
+        for pathname, stat, fingerprint, shahash in self.maybe_moved:
+            moved_from = None
+            if shahash is None:
+                moved_from = take(leftover_fingerprints.get(fingerprint, ()),
+                                  lambda entry: entry[:3] == stat)
+                if moved_from is None:
+                    need_hash.append((pathname, stat, fingerprint))
+                    continue
+                self.unverified.append((pathname, stat))
+            else:
+                moved_from = take(leftover_hashes.get(shahash, ()))
+            if moved_from is None:
+                self.counts['added'] += 1
+                add_item(pathname, shahash, stat, self.batch, fingerprint)
+            else:
+                moves.append((Path(moved_from), pathname, stat))
+
+        # fingerprints weren't enough for these, so it comes down to the full hash
+        self.maybe_moved = list()
+        for pathname, stat, fingerprint in need_hash:
+            self.hash_file(pathname, stat, None, fingerprint)
+        self.reconcile()
+        for pathname, stat, fingerprint, shahash in self.maybe_moved:
+            moved_from = take(leftover_hashes.get(shahash, ()))
+            if moved_from is None:
+                self.counts['added'] += 1
+                add_item(pathname, shahash, stat, self.batch, fingerprint)
+            else:
+                moves.append((Path(moved_from), pathname, stat))
+        self.maybe_moved = list()
+
+        self.counts['moved'] += len(moves)
+        move_items(moves, self.batch)
+
+    def finish(self):
+        """reconcile everything still outstanding, settle moves and deletions, commit"""
+        self.reconcile()
+        self.settle_moves()
+        self.batch.flush()
+        # the moves are committed, their contents can be checked now
+        for pathname, stat in self.unverified:
+            GLOBAL_DATA.verifier.request(pathname, stat)
+        self.unverified = list()
+        if self.pool is not None:
+            self.pool.shutdown()
+        self.resume_after = None
+
+        # whatever is still in the snapshot is gone from the directory tree
+        if self.snapshot:
+            print('Left over paths from database:')
+            for leftover_path in self.snapshot:
+                print(leftover_path)
+            self.counts['deleted'] += len(self.snapshot)
+            delete_items(list(self.snapshot))
+            self.snapshot.clear()
+
+        GLOBAL_DATA.updates_browse_list = True
+        self.status.update(state='complete', finished=time.time())
+        if self.directory is not None:
+            LOG.info('Rescan of %s: %d unchanged, %d modified, %d added, %d moved, %d deleted',
+                     self.directory, self.counts['unchanged'], self.counts['modified'],
+                     self.counts['added'], self.counts['moved'], self.counts['deleted'])
+            return
+        # the generation is complete - the next start begins a new one
+        set_mdata({'scan_state': 'complete', 'scan_last_dir': '',
+                   'scan_counts': json.dumps(self.counts)})
+        LOG.info('Initial scan: %(unchanged)d unchanged, %(modified)d modified, %(added)d added, '
+                 '%(moved)d moved, %(deleted)d deleted', self.counts)
+
+    def abort(self):
+        """stop without settling moves or deletions - commit what was already worked out"""
+        self.status['state'] = 'interrupted'
+        if self.pool is not None:
+            self.pool.shutdown(wait=False)
+        try:
+            self.batch.flush()
+        except Exception as exception_info:
+            LOG.error('Could not commit the last scan batch: %s', exception_info)
+
+
+def compile_scan_rules():
+    """
+    helper for walk_directory_tree - the ignored directories and excluded extensions, as
+    sets of plain strings so each check is a single lookup
+    """
+    ignored = {os.path.normpath(str(dire)) for dire in IGNORED_DIRECTORIES}
+    excluded = {extension.lstrip('.').lower() for extension in EXCLUDE_EXTENSIONS}
+    return ignored, excluded
+
+
+def walk_directory_tree(directory=''):
+    """
+    Generator over every regular file in the directory tree, yielding (Path, DirEntry) pairs
+    as they are found, so the caller can get to work before the walk is done. Iterative, so
+    deep trees can't hit the recursion limit. Ignored directories are pruned without being
+    opened. Entries are visited in name order, so two walks of the same tree agree.
+    """
+    ignored, excluded = compile_scan_rules()
+    stack = [directory]
+    while stack:
+        current = stack.pop()
+        try:
+            with os.scandir(current or '.') as iterator:
+                entries = sorted(iterator, key=lambda entry: entry.name)
+        except OSError as exception_info:
+            LOG.info('skipping directory %s: %s', current, exception_info)
+            continue
+
+        subdirectories = list()
+        for entry in entries:
+            relative = os.path.join(current, entry.name) if current else entry.name
+            try:
+                # the DirEntry knows its own type, no extra stat call needed.
+                # Don't follow directory links - they can make loops.
+                if entry.is_dir(follow_symlinks=False):
+                    if relative not in ignored:
+                        subdirectories.append(relative)
+                elif entry.is_file():
+                    # skip files with an excluded extension
+                    if os.path.splitext(entry.name)[1].lstrip('.').lower() not in excluded:
+                        yield Path(relative), entry
+                else:
+                    LOG.info('skipping: %s - what is this anyway?', relative)
+            except OSError:
+                LOG.info('File has disappeared: %s', relative)
+
+        # push in reverse, so the subdirectories come off the stack in name order
+        stack.extend(reversed(subdirectories))
 
 
-def initial_file_scan():
+def initial_file_scan(workers=HASH_WORKERS, pool_type=HASH_POOL_TYPE, verify=False,
+                      batch_size=INGEST_BATCH_SIZE):
     """do this when first starting up - re-sync with directory tree"""
     # get positioned at the root of file system tree
     os.chdir(ROOT_DIRECTORY)
 
     # walk the directory tree, adding whatever you find that is missing
-    # determine if the database has anything in it, if not, we can blindly add
-    walk_directory_tree(Path('.'))
-
-    if GLOBAL_DATA.all_paths.__len__() > 0:
-        print('Left over paths from database:')
-        for leftover_path in GLOBAL_DATA.all_paths:
-            print(str(leftover_path))
-            delete_item(leftover_path)
-
+    # determine if the database has anything in it, if not, we can blindly add.
+    # The pool gets created after the chdir, so the workers see relative paths the same way.
+    scanner = ScanReconciler(workers, pool_type, verify, batch_size)
+    scanner.start_generation()
+    current_directory = None
+    try:
+        for pathname, entry in walk_directory_tree():
+            # a directory's files all come out of the walk together
+            directory = str(pathname.parent)
+            if directory != current_directory:
+                if current_directory is not None:
+                    scanner.directory_done(current_directory)
+                current_directory = directory
+            if scanner.resumed_past(pathname):
+                scanner.file_already_seen(pathname)
+            else:
+                scanner.file_found(pathname, entry)
+            # the web UI is already up, don't keep it waiting on the scan. What's on the
+            # QUEUE (edits, finished previews) has to see the items of the open batch - a
+            # preview that matches no item yet would be thrown away - so commit it first.
+            if not QUEUE.empty():
+                scanner.batch.flush()
+                service_gui_queue()
+    except BaseException:
+        # don't settle deletions from a partial walk, everything not yet seen would go
+        scanner.abort()
+        raise
+    scanner.finish()
+
+
+def rescan_directory(directory, service_queue=service_gui_queue):
+    """
+    Re-sync one directory subtree with the database, the way the initial scan does the
+    whole tree - used instead of replaying an event storm. service_queue is called
+    whenever there's something on the QUEUE, so the web UI isn't kept waiting.
+    """
+    LOG.info('Rescanning %s', directory)
+    # hash in threads - starting up a process pool isn't worth it for one directory
+    scanner = ScanReconciler(pool_type='thread', directory=directory)
+    try:
+        for pathname, entry in walk_directory_tree(directory):
+            scanner.file_found(pathname, entry)
+            if not QUEUE.empty():
+                scanner.batch.flush()  # as in initial_file_scan
+                service_queue()
+    except BaseException:
+        scanner.abort()
+        raise
+    scanner.finish()
 
 
 # -----------------------------------------------------------------------------------------------------
 # Callbacks for Web GUI and helper functions
 
+# the searches' labels column: an item's labels, comma separated, from item_labels
+ITEM_LABELS_SQL = "(SELECT group_concat(labels.label) FROM item_labels JOIN labels " \
+                  "ON labels.id = item_labels.label_id WHERE item_labels.item_id = items.id)"
+
+
+def labels_condition(labels):
+    """
+    SQL condition for the searches: the item has any of these labels. Whole labels only,
+    and it's looked up through the item_labels index, not by scanning every item.
+    """
+    quoted = ', '.join("'" + label.replace("'", "''") + "'" for label in labels)
+    return "items.id IN (SELECT item_labels.item_id FROM item_labels JOIN labels ON " \
+           f"labels.id = item_labels.label_id WHERE labels.label IN ({quoted})) "
+
+
+def directories_condition(directories, dir_mode):
+    """
+    SQL condition for the searches: the item is right in one of these directories (dirs
+    mode), or anywhere below one (trees mode). Both are lookups on the dir column's index -
+    equality, or for a tree the directory plus the range of everything under it.
+    """
+    conditions = list()
+    for directory in directories:
+        # the dir column has / separators, see dir_key
+        directory = directory.replace(os.sep, '/').strip('/').replace("'", "''")
+        if dir_mode:
+            conditions.append(f"items.dir = '{directory}'")
+        else:
+            # '/' sorts just before '0', so this range is exactly what's below the directory
+            conditions.append(f"items.dir = '{directory}' OR "
+                              f"(items.dir >= '{directory}/' AND items.dir < '{directory}0')")
+    return "(" + ") OR (".join(conditions) + ") "
+
+
+def query_values(query_string_dict, key):
+    """a search parameter's values - the comma separated ones split apart, blanks dropped"""
+    return [value for values in query_string_dict.get(key, list())
+            for value in values.split(',') if value]
+
+
+class SearchResults:
+    """
+    What one search put on its page, for the requests the page makes afterwards. The page
+    carries the search's id and sends it back, so two tabs, or two searches running at
+    once, never get each other's results.
+    """
+
+    def __init__(self):
+        self.paths = list()  # item_counter -> path, for the edits (labels etc.) on the page
+        self.biblerefs = list()  # item_counter -> the item's biblerefs, as numbered on the page
+        self.thumbs = list()  # (item_counter, thumb) for /search_thumbnails
+
+
+def new_search_results():
+    """(search id, SearchResults) for a new search - only the latest SEARCHES_KEPT are kept"""
+    results = SearchResults()
+    with GLOBAL_DATA.searches_lock:
+        search_id = next(GLOBAL_DATA.search_ids)
+        GLOBAL_DATA.searches[search_id] = results
+        while len(GLOBAL_DATA.searches) > SEARCHES_KEPT:
+            GLOBAL_DATA.searches.popitem(last=False)
+    return search_id, results
+
+
+def search_results(search_id):
+    """the SearchResults a page's search id refers to, None if unknown or long gone"""
+    try:
+        search_id = int(search_id)
+    except (TypeError, ValueError):
+        return None
+    with GLOBAL_DATA.searches_lock:
+        return GLOBAL_DATA.searches.get(search_id)
+
+
+def page_search_results():
+    """the SearchResults of the page a web UI request came from - its ?search=<id>"""
+    results = search_results(bottle_request.query.search)
+    if results is None:
+        bottle_abort(409, 'These search results are out of date, please search again')
+    return results
+
+
 def generate_search_output(queue_entry):
 
+    search_id, results = new_search_results()
     # this is the top menu-bar for the search results
-    result_string = """
-    <div class="mt-4 mb-2">
+    result_string = f"""
+    <div class="mt-4 mb-2" id="search-results" data-search="{search_id}">
       <table class="bottom-border" width="100%">
         <tr>
           <td><b class="h4">Search Results:</b></td>
@@ -751,17 +2471,23 @@ def generate_search_output(queue_entry):
     """
 
 
-    GLOBAL_DATA.search_results_map = item_map = list()
-    GLOBAL_DATA.search_results_biblerefs = biblerefs_map = list()
+    item_map = results.paths
+    biblerefs_map = results.biblerefs
+    # the previews are fetched all together by the page, from /search_thumbnails
+    thumbs_map = results.thumbs
     item_counter = 0
     for row in queue_entry['rows']:
         path = row[0]
         item_map.append(path)
 
         if row[1]:  # handle blank thumbnail path
-            thumbnail = f'thumbnails/{row[1]}'
+            thumbs_map.append((item_counter, row[1]))
+            thumbnail = ''  # filled in by load_search_thumbnails() in main.js
         else:
             thumbnail = '/static_files/img/no-preview.png'
+            if row[7] == 'pending':
+                # the user is looking at it, so move its preview to the front of the line
+                GLOBAL_DATA.previews.request(path, row[8], urgent=True)
 
         if thumbnail is None:
             print(f'Thumbnail is None for {path}')
@@ -847,7 +2573,7 @@ def generate_search_output(queue_entry):
 
         item_entry = f"""
           <table width="100%" class="mt-2"><col width="230px"><col><col width="20px">
-              <tr><td width="230px" height="200px" class="align-top"><img src="{thumbnail}"></td>
+              <tr><td width="230px" height="200px" class="align-top"><img id="thumb-{item_counter}" src="{thumbnail}"></td>
                   <td class="align-top">
                      <table>
                         <tr><td><b class="bigpath path-{item_counter}">{path}</b>{new_indicator}</td></tr>               
@@ -884,116 +2610,33 @@ def search_documents():
 
     query_string_dict = bottle_request.query.dict
     # if no dirs or trees in the query string, then mode should be dirs
-    dir_mode = True
-    if 'dirs' in query_string_dict or 'trees' in query_string_dict:
-        if 'dirs' in query_string_dict:
-            directories = query_string_dict['dirs']
-        else:
-            directories = query_string_dict['trees']
-            # add wildcard to each directory
-            dir_mode = False
-        if directories and len(directories) == 1 and directories[0] == '':
-            directories = []
-
-    else:
-        directories = []
-
-    # correct windows backslashes to forward.
-    # Scratch this -- need to do the correction in the sql instead since paths have backslashes in the database
-    # for idx, dire in enumerate(directories):
-    #   if '\\' in dire:
-    #        directories[idx] = dire.replace('\\','/')
-    #        LOG.info(directories[idx])
-
-    if 'labels' in query_string_dict:
-        labels = query_string_dict['labels']
-    else:
-        labels = []
+    dir_mode = 'dirs' in query_string_dict or 'trees' not in query_string_dict
+    directories = query_values(query_string_dict, 'dirs' if dir_mode else 'trees')
+    labels = query_values(query_string_dict, 'labels')
 
     # log_msg = f'directories = "{directories}", mode = "{dir_mode}", labels = "{labels}"'
     # LOG.info(log_msg)
 
-    textual_sql = ["SELECT items.path, items.thumb, items.labels, items.bibleref, " \
-                   "items.related, EXISTS(select new.path from new where (new.path == items.path)), items.date_created FROM items ", ]
-    if not directories:
-        if not labels:
-            # LOG.info('no dirs, no label, dir_mode: %s', dir_mode)
-            # just do the top level unless in tree mode
-            if dir_mode:
-                textual_sql.append("WHERE ( path NOT LIKE '%/%' )")
-        else:
-            textual_sql.append("WHERE ( ")
-            firsttime = True
-            for label in labels:
-                if firsttime:
-                    firsttime = False
-                    conn_str = ""
-                else:
-                    conn_str = " OR "
-                textual_sql.append(conn_str + f"labels LIKE '%{label}%' ")
-            textual_sql.append(")")
-
-    else: # we have directory pieces
-        if not labels:
-            # have dirs without labels
-            firsttime = True
-            textual_sql.append("WHERE (")
-            for dire in directories:
-                if dir_mode:
-                    if firsttime:
-                        textual_sql.append(f"(path LIKE '{dire}/%' AND path NOT LIKE '{dire}/%/%')")
-                        firsttime = False
-                    else:
-                        textual_sql.append(f"OR (path LIKE '{dire}/%' AND path NOT LIKE " \
-                                               + f"'{dire}/%/%')")
-                else: # tree mode - want all subdirs
-                    if firsttime:
-                        textual_sql.append(f"(path LIKE '{dire}/%')")
-                        firsttime = False
-                    else:
-                        textual_sql.append(" OR (path LIKE '{d}/%')")
-            textual_sql.append(")")
-
-        else:   # both labels and dirs
-            textual_sql.append("WHERE ( (")
-            firsttime = True
-            for label in labels:
-                if firsttime:
-                    firsttime = False
-                    conn_str = ""
-                else:
-                    conn_str = " OR "
-                textual_sql.append(conn_str + f"labels LIKE '%{label}%' ")
-
-            textual_sql.append(") AND (")
-
-            firsttime = True
-            for dire in directories:
-                if dir_mode:
-                    if firsttime:
-                        textual_sql.append(f"(path LIKE '{dire}/%' AND path NOT LIKE '{dire}/%/%')")
-                        firsttime = False
-                    else:
-                        textual_sql.append(f"OR (path LIKE '{dire}/%' AND path NOT LIKE "  \
-                                               f"'{dire}/%/%')")
-                else: # tree mode - want all subdirs
-                    if firsttime:
-                        textual_sql.append(f"(path LIKE '{dire}/%')")
-                        firsttime = False
-                    else:
-                        textual_sql.append(" OR (path LIKE '{d}/%')")
-            textual_sql.append(") )")
+    textual_sql = ["SELECT items.path, items.thumb, " + ITEM_LABELS_SQL + ", items.bibleref, " \
+                   "items.related, EXISTS(select new.path from new where (new.path == items.path)), items.date_created, " \
+                   "items.thumb_state, items.shahash FROM items ", ]
+    conditions = list()
+    if labels:
+        conditions.append(labels_condition(labels))
+    if directories:
+        conditions.append(directories_condition(directories, dir_mode))
+    elif dir_mode and not labels:
+        # just do the top level unless in tree mode
+        conditions.append("items.dir = '' ")
+    if conditions:
+        textual_sql.append("WHERE ( (" + ") AND (".join(conditions) + ") )")
 
     # LOG.info('textual_sql: %s', str(','.join(textual_sql)))
 
     
     sqlcommand = None
     try:
-        if sys.platform == 'linux':
-            sqlcommand = sqltext(''.join(textual_sql))
-        else:
-            #replace forward slashes with backslashes in Windows
-            sqlcommand = sqltext(''.join(textual_sql).replace('/','\\'))
+        sqlcommand = sqltext(''.join(textual_sql))
         #LOG.info(sqlcommand)
     
     except TypeError as exc:
@@ -1013,11 +2656,7 @@ def search_documents():
     try:
         # Ok, we are in the wrong thread to run a SQL query - so use the queues to get
         # the request to the right thread. Results are
-        QUEUE.put({'type': 'gui', 'select': sqlcommand})
-        while RESULTSQ.empty():
-            time.sleep(0.02)
-        queue_entry = RESULTSQ.get(True, 150)
-        RESULTSQ.task_done()
+        queue_entry = db_read(sqlcommand)
         # more processing below
 
     except Exception as exc:
@@ -1058,18 +2697,13 @@ def search_biblerefs():
         LOG.error('/search_biblerefs called without biblerefs!')
         return 'ERROR in search - no biblerefs given'
 
-    labels = [rlabel for rlabel in query_string_dict['labels']
-               if rlabel and len(rlabel) > 0]
+    labels = query_values(query_string_dict, 'labels')
 
-    textual_sql = ["SELECT items.path, items.thumb, items.labels, items.bibleref, " \
-                   "items.related, EXISTS(select new.path from new where (new.path == items.path)), items.date_created FROM items ", ]
+    textual_sql = ["SELECT items.path, items.thumb, " + ITEM_LABELS_SQL + ", items.bibleref, " \
+                   "items.related, EXISTS(select new.path from new where (new.path == items.path)), items.date_created, " \
+                   "items.thumb_state, items.shahash FROM items ", ]
     if labels:
-        textual_sql.append("WHERE ( ")
-        conn_str = ''
-        for label in labels:
-            textual_sql.append(conn_str + f"labels LIKE '%{label}%' ")
-            conn_str = ' OR '
-        textual_sql.append(")")
+        textual_sql.append("WHERE ( " + labels_condition(labels) + ")")
 
     LOG.info('textual_sql: %s', str(''.join(textual_sql)))
 
@@ -1093,11 +2727,7 @@ def search_biblerefs():
     try:
         # Ok, we are in the wrong thread to run a SQL query - so use the queues to get
         # the request to the right thread. Results are
-        QUEUE.put({'type': 'gui', 'select': sqlcommand})
-        while RESULTSQ.empty():
-            time.sleep(0.02)
-        queue_entry = RESULTSQ.get(True, 150)
-        RESULTSQ.task_done()
+        queue_entry = db_read(sqlcommand)
         # more processing below
 
     except Exception as exc:
@@ -1171,111 +2801,24 @@ def search_new_documents():
 
     query_string_dict = bottle_request.query.dict
     # if no dirs or trees in the query string, then mode should be dirs
-    dir_mode = True
-    if 'dirs' in query_string_dict or 'trees' in query_string_dict:
-        if 'dirs' in query_string_dict:
-            directories = query_string_dict['dirs']
-        else:
-            directories = query_string_dict['trees']
-            # add wildcard to each directory
-            dir_mode = False
-        if directories and len(directories) == 1 and directories[0] == '':
-            directories = []
-
-    else:
-        directories = []
-
-    # correct windows backslashes to forward.
-    for idx, dire in enumerate(directories):
-        if '\\' in dire:
-            directories[idx] = dire.replace('\\','/')
-
-    if 'labels' in query_string_dict:
-        labels = query_string_dict['labels']
-    else:
-        labels = []
-
-    where_present = False  # whether a WHERE class as already been started
-
-    textual_sql = ["SELECT items.path, items.thumb, items.labels, items.bibleref, " \
-                   + "items.related, EXISTS(select new.path from new where (new.path == items.path)), items.date_created FROM items ", ]
-    if not directories:
-        if not labels:
-            # just do the top level unless in tree mode
-            if dir_mode:
-                textual_sql.append("WHERE (path NOT LIKE '%/%' ")
-                where_present = True
-        else:
-            textual_sql.append("WHERE ( ")
-            where_present = True
-            firsttime = True
-            for label in labels:
-                if firsttime:
-                    firsttime = False
-                    conn_str = ''
-                else:
-                    conn_str = ' OR '
-                textual_sql.append(conn_str + f"labels LIKE '%{label}%' ")
-
-    else: # we have directory pieces
-        if not labels:
-            # have dirs without labels
-            firsttime = True
-            textual_sql.append("WHERE (")
-            where_present = True
-            for dire in directories:
-                if dir_mode:
-                    if firsttime:
-                        textual_sql.append(f"(path LIKE '{dire}/%' AND path NOT LIKE '{dire}/%/%')")
-                        firsttime = False
-                    else:
-                        textual_sql.append(f"OR (path LIKE '{dire}/%' AND path NOT LIKE " \
-                                               + f"'{dire}/%/%')")
-                else: # tree mode - want all subdirs
-                    if firsttime:
-                        textual_sql.append(f"(path LIKE '{dire}/%')")
-                        firsttime = False
-                    else:
-                        textual_sql.append(" OR (path LIKE '{d}/%')")
-
-        else:   # both labels and dirs
-            textual_sql.append("WHERE ( (")
-            where_present = True
-            firsttime = True
-            for label in labels:
-                if firsttime:
-                    firsttime = False
-                    conn_str = ""
-                else:
-                    conn_str = " OR "
-                textual_sql.append(conn_str + f"labels LIKE '%{label}%' ")
-
-            textual_sql.append(") AND (")
-
-            firsttime = True
-            for dire in directories:
-                if dir_mode:
-                    if firsttime:
-                        textual_sql.append(f"(path LIKE '{dire}/%' AND path NOT LIKE '{dire}/%/%')")
-                        firsttime = False
-                    else:
-                        textual_sql.append(f"OR (path LIKE '{dire}/%' AND path NOT LIKE "  \
-                                               f"'{dire}/%/%')")
-                else: # tree mode - want all subdirs
-                    if firsttime:
-                        textual_sql.append(f"(path LIKE '{dire}/%')")
-                        firsttime = False
-                    else:
-                        textual_sql.append(" OR (path LIKE '{d}/%')")
-            textual_sql.append(") ")
-
+    dir_mode = 'dirs' in query_string_dict or 'trees' not in query_string_dict
+    directories = query_values(query_string_dict, 'dirs' if dir_mode else 'trees')
+    labels = query_values(query_string_dict, 'labels')
+
+    textual_sql = ["SELECT items.path, items.thumb, " + ITEM_LABELS_SQL + ", items.bibleref, " \
+                   "items.related, EXISTS(select new.path from new where (new.path == items.path)), items.date_created, " \
+                   "items.thumb_state, items.shahash FROM items ", ]
+    conditions = list()
+    if labels:
+        conditions.append(labels_condition(labels))
+    if directories:
+        conditions.append(directories_condition(directories, dir_mode))
+    elif dir_mode and not labels:
+        # just do the top level unless in tree mode
+        conditions.append("items.dir = '' ")
     # Add the NEW condition
-    if where_present:
-        textual_sql.append(" AND ")
-    else:
-        textual_sql.append("WHERE ( ")
-
-    textual_sql.append(" path in (SELECT path FROM new) )")
+    conditions.append("items.path IN (SELECT path FROM new) ")
+    textual_sql.append("WHERE ( (" + ") AND (".join(conditions) + ") )")
 
     LOG.info('textual_sql: %s', str(' '.join(textual_sql)))
 
@@ -1299,11 +2842,7 @@ def search_new_documents():
     try:
         # Ok, we are in the wrong thread to run a SQL query - so use the queues to get
         # the request to the right thread. Results are
-        QUEUE.put({'type': 'gui', 'select': sqlcommand})
-        while RESULTSQ.empty():
-            time.sleep(0.02)
-        queue_entry = RESULTSQ.get(True, 150)
-        RESULTSQ.task_done()
+        queue_entry = db_read(sqlcommand)
         # more processing below
 
     except Exception as exc:
@@ -1327,15 +2866,15 @@ def search_new_documents():
 def browse_list():
     "return JSON data on the file/directory structure"
 
-    # do I NOT already have up-to-date browse list?
-    if GLOBAL_DATA.browse_list_object is None or GLOBAL_DATA.updates_browse_list:
+    # Requests run on the web server's threads, so the browse list is built in a local and
+    # only then put in place - another request keeps using the one it already picked up.
+    browse_list_object = GLOBAL_DATA.browse_list_object
 
-        if GLOBAL_DATA.browse_list_object is not None:
-            # delete the existing tree of BLPathTreeNode objects
-            GLOBAL_DATA.browse_list_object.delete_tree()
-            del GLOBAL_DATA.browse_list_object
+    # do I NOT already have up-to-date browse list?
+    if browse_list_object is None or GLOBAL_DATA.updates_browse_list:
 
-        # I am now updating it, so clear updates flag
+        # I am now updating it, so clear updates flag - a scan batch, monitor change or
+        # directory move or delete committed after this sets it again
         GLOBAL_DATA.updates_browse_list = False
 
         # a little safety check before the database query
@@ -1343,32 +2882,24 @@ def browse_list():
             LOG.error(f'GLOBAL_DATA.tb_items is None in search_path')
             raise NotImplementedError('Database data structures not ready')
 
-        # do database query - this must happen in the main thread because that
-        # is where the SQLite objects are created and must be used. So put
-        # the request on the queue QUEUE and wait for the results on the queue
-        # RESULTSQ
+        # do database query - a read, so it runs right here on one of the pooled
+        # read connections, see db_read
 
         if BROWSE_LIST_INCLUDE_FILES:
             sel = sqlselect([GLOBAL_DATA.tb_items.c.path,]).order_by('path')
         else:
-            sel = sqlselect([GLOBAL_DATA.tb_items.c.dir, ]).where('dir' != '')
-
-        QUEUE.put({'type': 'gui', 'select': sel})
+            # one row per directory, straight from the dir index
+            sel = sqlselect([GLOBAL_DATA.tb_items.c.dir, ]).distinct() \
+                .where(GLOBAL_DATA.tb_items.c.dir != '')
 
-        while RESULTSQ.empty():
-            time.sleep(0.01)
-
-        # set a longer timeout, cause we're not handling it if it expires
-        queue_entry = RESULTSQ.get(True, 150)
+        queue_entry = db_read(sel)
         rows = queue_entry['rows']
-        RESULTSQ.task_done()
 
         if BROWSE_LIST_INCLUDE_FILES:
 
             # convert to tree representation
             current_directory = Path('')
-            current_node = BLPathTreeNode('{root}')
-            GLOBAL_DATA.browse_list_object = current_node
+            current_node = tree = BLPathTreeNode('{root}')
 
             # REMEMBER: every row returned has a file and not a directory
             for row in rows:
@@ -1387,13 +2918,13 @@ def browse_list():
                     else:
                         # new is just a file, old was a subdirectory, so we can drop dir stuff
                         current_directory = Path('')
-                        current_node = GLOBAL_DATA.browse_list_object
+                        current_node = tree
                 else:
                     # now, new file in subdirectory, what about current
                     if len(current_parts) == 1:
                         # current is top-level file, now build dir structure
                         # of new, if it doesn't exist
-                        current_node = current_node.create_path(new_file_parts)
+                        current_node = current_node.create_path(new_file_parts, tree)
                         current_node.add_child(new_file_parts[-1]) # then add the file
                     else:
                         # have we come to the same directory?
@@ -1407,28 +2938,31 @@ def browse_list():
                                 idx += 1
                             if no_deal:
                                 # just work through the path
-                                current_node = current_node.create_path(new_file_parts)
+                                current_node = current_node.create_path(new_file_parts, tree)
                                 current_node.add_child(new_file_parts[-1])
                             else:
                                 # current directory is the same as the new one, so just add the node
                                 current_node.add_child(new_file_parts[-1])
                         else: # new file parts has different number of parts than current, so
                             # just work through the path
-                            current_node = current_node.create_path(new_file_parts)
+                            current_node = current_node.create_path(new_file_parts, tree)
                             current_node.add_child(new_file_parts[-1])
+            browse_list_object = tree
 
         else: # not BROWSE_LIST_INCLUDE_FILES
             # this is simplified vs above
-            if GLOBAL_DATA.browse_list_object is not None:
-                del GLOBAL_DATA.browse_list_object
             dirs_used = list()
-            GLOBAL_DATA.browse_list_object = dirs_used
             top_dir = Path('.')
             slash_dir = Path('/')
-            for row in rows:
+            # by path component, so each directory comes right before what's below it
+            for row in sorted(rows, key=lambda row: row[0].split('/')):
                 dire = row[0]
                 if dire and top_dir != dire and slash_dir != dire and dire not in dirs_used:
                     dirs_used.append(dire)
+            browse_list_object = dirs_used
+
+        # the old one is simply dropped, a request still outputting it can finish
+        GLOBAL_DATA.browse_list_object = browse_list_object
 
         # processed all data returned from dB query. Now, generate the output.
 
@@ -1437,9 +2971,9 @@ def browse_list():
     final_output = '{"core": {"data": [{"text": "{root}", "state": {"opened": true},"children": ['
 
     if BROWSE_LIST_INCLUDE_FILES:
-        final_output += GLOBAL_DATA.browse_list_object.repr_children()
+        final_output += browse_list_object.repr_children()
     else:
-        final_output += bl_output_directories_structure()
+        final_output += bl_output_directories_structure(browse_list_object)
 
     final_output += ']}]}}'
     # print('browse list:\n', final_output)
@@ -1469,15 +3003,8 @@ def get_labels():
     "return JSON of array of labels"
 
     sel = sqlselect([GLOBAL_DATA.tb_labels.c.label, ]).order_by('label')
-    QUEUE.put({'type': 'gui', 'select': sel})
-
-    while RESULTSQ.empty():
-        time.sleep(0.01)  # Again, keep this timing tight, user is waiting!
-
-    # set a longer timeout, cause we're not handling it if it expires
-    queue_entry = RESULTSQ.get(True, 150)
+    queue_entry = db_read(sel)
     rows = queue_entry['rows']
-    RESULTSQ.task_done()
     results = [str(r[0]) for r in rows]
 
     return json.dumps(results)
@@ -1491,106 +3018,87 @@ def remove_label():
     parts = label_id.split('-')
     assert len(parts) == 3
     assert parts[0] == 'search'
-    path = GLOBAL_DATA.search_results_map[int(parts[1])]
+    path = page_search_results().paths[int(parts[1])]
     label = parts[2]
-    # get existing labels
-    textual_sql = f"SELECT labels from items WHERE path = '{path}';"
-    sqlcommand = sqltext(textual_sql)
-    QUEUE.put({'type': 'gui', 'select': sqlcommand})
-    while RESULTSQ.empty():
-        time.sleep(0.01)
-    # set a longer timeout, cause we're not handling it if it expires
-    queue_entry = RESULTSQ.get(True, 150)
-    rows = queue_entry['rows']
-    RESULTSQ.task_done()
-    assert len(rows) == 1
-    existing_labels = (rows[0][0]).split(',')
-    if existing_labels.count(label) >= 0:
-        existing_labels.remove(label)
-        new_label_str = ','.join(existing_labels)
-        textual_sql = f"UPDATE items set labels = '{new_label_str}' WHERE path = '{path}';"
-        sqlcommand = sqltext(textual_sql)
-        QUEUE.put({'type': 'gui', 'select': sqlcommand})
-        while RESULTSQ.empty():
-            time.sleep(0.01)
-        # set a longer timeout, cause we're not handling it if it expires
-        queue_entry = RESULTSQ.get(True, 150)
-        RESULTSQ.task_done()
-
-        # now - update the labels table, as needed
-        # 1. are there any other items still having the same label?
-        textual_sql = f"SELECT labels from items where labels LIKE '%{label}%'"
-        sqlcommand = sqltext(textual_sql)
-        QUEUE.put({'type': 'gui', 'select': sqlcommand})
-        while RESULTSQ.empty():
-            time.sleep(0.01)
-        # set a longer timeout, cause we're not handling it if it expires
-        queue_entry = RESULTSQ.get(True, 150)
-        RESULTSQ.task_done()
-        rows = queue_entry['rows']
-        if len(rows) == 0:  # no other uses of the label, so can remove it
-            textual_sql = f"DELETE FROM labels WHERE label = '{label}';"
-            sqlcommand = sqltext(textual_sql)
-            QUEUE.put({'type': 'gui', 'select': sqlcommand})
-            while RESULTSQ.empty():
-                time.sleep(0.01)
-            # set a longer timeout, cause we're not handling it if it expires
-            queue_entry = RESULTSQ.get(True, 150)
-            RESULTSQ.task_done()
-
-        # else nothing needs to be done because the label is still in use
+
+    def edit(conn):
+        textual_sql = "DELETE FROM item_labels " \
+                      "WHERE item_id = (SELECT id FROM items WHERE path = :path) " \
+                      "AND label_id = (SELECT id FROM labels WHERE label = :label);"
+        conn.execute(sqltext(textual_sql), path=path, label=label)
+
+        # now - update the labels table, as needed: drop the label if no other item has it
+        textual_sql = "DELETE FROM labels WHERE label = :label AND NOT EXISTS(" \
+                      "SELECT 1 FROM item_labels WHERE label_id = labels.id);"
+        conn.execute(sqltext(textual_sql), label=label)
         return 'success'
 
+    return db_edit(edit)
+
 
 @bottle_route('/add_label')
 def add_label():
     # /add_label?item_id=3;labels=obstanant
     item_id = bottle_request.query.item_id
-    path = GLOBAL_DATA.search_results_map[int(item_id)]
+    path = page_search_results().paths[int(item_id)]
     new_labels_str = bottle_request.query.labels
     new_labels = new_labels_str.split(',')
-    # get existing labels
-    textual_sql = f"SELECT labels from items WHERE path = '{path}';"
-    sqlcommand = sqltext(textual_sql)
-    QUEUE.put({'type': 'gui', 'select': sqlcommand})
-    while RESULTSQ.empty():
-        time.sleep(0.01)
-    # set a longer timeout, cause we're not handling it if it expires
-    queue_entry = RESULTSQ.get(True, 150)
-    rows = queue_entry['rows']
-    RESULTSQ.task_done()
-    assert len(rows) == 1
-    raw_labels = str(rows[0][0])
-    if raw_labels == '':
-        existing_labels = list()
-    else:
-        existing_labels = raw_labels.split(',')
-    updated_labels = list(set(existing_labels + new_labels))  # filter through set() to drop duplicates
-    updated_label_str = ','.join(updated_labels)
-    textual_sql = f"UPDATE items set labels = '{updated_label_str}' WHERE path = '{path}';"
-    sqlcommand = sqltext(textual_sql)
-    QUEUE.put({'type': 'gui', 'select': sqlcommand})
-    while RESULTSQ.empty():
-        time.sleep(0.01)
-    # set a longer timeout, cause we're not handling it if it expires
-    queue_entry = RESULTSQ.get(True, 150)
-    RESULTSQ.task_done()
-
-    # add to labels table, if not already present
-    for label in new_labels:
-        textual_sql = f"INSERT INTO labels(label) SELECT '{label}' "  \
-                + f"WHERE NOT EXISTS(SELECT 1 FROM labels WHERE label = '{label}');"
-        sqlcommand = sqltext(textual_sql)
-        QUEUE.put({'type': 'gui', 'select': sqlcommand})
-        while RESULTSQ.empty():
-            time.sleep(0.01)
-        # set a longer timeout, cause we're not handling it if it expires
-        queue_entry = RESULTSQ.get(True, 150)
-        RESULTSQ.task_done()
 
+    def edit(conn):
+        for label in {label for label in new_labels if label}:  # set() drops duplicates
+            # add to labels table, if not already present, then tie it to the item
+            textual_sql = "INSERT OR IGNORE INTO labels(label) VALUES (:label);"
+            conn.execute(sqltext(textual_sql), label=label)
+            textual_sql = "INSERT OR IGNORE INTO item_labels(item_id, label_id) " \
+                          "SELECT items.id, labels.id FROM items, labels " \
+                          "WHERE items.path = :path AND labels.label = :label;"
+            conn.execute(sqltext(textual_sql), path=path, label=label)
+
+    db_edit(edit)
     return f'added {new_labels_str} to {path}'
 
 
+@bottle_route('/bulk_labels')
+def bulk_labels():
+    """
+    A bulk action adding or removing labels on all the marked items - one edit, so one
+    commit however many items are marked.
+    """
+    # /bulk_labels?action=add&items=3,5,8&labels=apples,pears
+    action = bottle_request.query.action
+    if action not in ('add', 'remove'):
+        bottle_abort(400, f'Unknown bulk label action: {action}')
+    all_paths = page_search_results().paths
+    # (query.items is the dict method, not the parameter)
+    item_ids = bottle_request.query.get('items', '').split(',')
+    paths = [all_paths[int(item_id)] for item_id in item_ids if item_id]
+    labels = {label for label in bottle_request.query.labels.split(',') if label}
+    rows = [dict(path=path, label=label) for path in paths for label in labels]
+
+    def edit(conn):
+        if not rows:
+            return
+        if action == 'add':
+            conn.execute(sqltext("INSERT OR IGNORE INTO labels(label) VALUES (:label);"),
+                         [dict(label=label) for label in labels])
+            textual_sql = "INSERT OR IGNORE INTO item_labels(item_id, label_id) " \
+                          "SELECT items.id, labels.id FROM items, labels " \
+                          "WHERE items.path = :path AND labels.label = :label;"
+            conn.execute(sqltext(textual_sql), rows)
+        else:
+            textual_sql = "DELETE FROM item_labels " \
+                          "WHERE item_id = (SELECT id FROM items WHERE path = :path) " \
+                          "AND label_id = (SELECT id FROM labels WHERE label = :label);"
+            conn.execute(sqltext(textual_sql), rows)
+            # drop the labels no other item has any more
+            textual_sql = "DELETE FROM labels WHERE label = :label AND NOT EXISTS(" \
+                          "SELECT 1 FROM item_labels WHERE label_id = labels.id);"
+            conn.execute(sqltext(textual_sql), [dict(label=label) for label in labels])
+
+    db_edit(edit)
+    return f'{action} {",".join(sorted(labels))} on {len(paths)} items'
+
+
 @bottle_route('/remove_bibleref')
 def remove_bibleref():
     # /remove_bibleref?id=search-2-BR3
@@ -1600,9 +3108,10 @@ def remove_bibleref():
     assert len(parts) == 3
     assert parts[0] == 'search'
     item_counter = int(parts[1])
-    path = GLOBAL_DATA.search_results_map[item_counter]
+    results = page_search_results()
+    path = results.paths[item_counter]
     bibleref_num = int(parts[2][2:])  # Skip over fixed 'BR' string
-    biblerefs = GLOBAL_DATA.search_results_biblerefs[item_counter]
+    biblerefs = results.biblerefs[item_counter]
 
     # keep an entry in the list, but null out the actual reference to keep numbering consistent
     biblerefs[bibleref_num] = None
@@ -1615,12 +3124,7 @@ def remove_bibleref():
 
     textual_sql = f"UPDATE items set bibleref = '{new_bibleref_str}' WHERE path = '{path}';"
     sqlcommand = sqltext(textual_sql)
-    QUEUE.put({'type': 'gui', 'select': sqlcommand})
-    while RESULTSQ.empty():
-        time.sleep(0.01)
-    # set a longer timeout, cause we're not handling it if it expires
-    queue_entry = RESULTSQ.get(True, 150)
-    RESULTSQ.task_done()
+    db_edit(lambda conn: conn.execute(sqlcommand).close())
     return 'success'
 
 
@@ -1628,11 +3132,12 @@ def remove_bibleref():
 def add_bibleref():
     # /add_bibleref?item_id=3;biblerefs=4
     item_id = int(bottle_request.query.item_id)
-    path = GLOBAL_DATA.search_results_map[item_id]
+    results = page_search_results()
+    path = results.paths[item_id]
     new_biblerefs_str = bottle_request.query.biblerefs
     print(f'add_bibleref called with biblerefs = {new_biblerefs_str}')
     new_biblerefs = new_biblerefs_str.split(',')
-    biblerefs_list = GLOBAL_DATA.search_results_biblerefs[item_id]
+    biblerefs_list = results.biblerefs[item_id]
     starting_num = len(biblerefs_list)
     last_num = starting_num
     for new_bibleref in new_biblerefs:
@@ -1644,12 +3149,7 @@ def add_bibleref():
     print(f'updating biblerefs: {updated_bibleref_str}')
     textual_sql = f"UPDATE items set bibleref = '{updated_bibleref_str}' WHERE path = '{path}';"
     sqlcommand = sqltext(textual_sql)
-    QUEUE.put({'type': 'gui', 'select': sqlcommand})
-    while RESULTSQ.empty():
-        time.sleep(0.01)
-    # set a longer timeout, cause we're not handling it if it expires
-    queue_entry = RESULTSQ.get(True, 150)
-    RESULTSQ.task_done()
+    db_edit(lambda conn: conn.execute(sqlcommand).close())
     print(f'added {new_biblerefs_str} to {path}')
     return last_num
 
@@ -1660,50 +3160,46 @@ def relate_items():
     print(raw_items)
     items = raw_items.split(',')
     indicies = (int(items[0]), int(items[1]))
-    paths = (GLOBAL_DATA.search_results_map[indicies[0]],
-             GLOBAL_DATA.search_results_map[indicies[1]])
-    textual_sql = f"SELECT path, related from items WHERE path in ('{paths[0]}', '{paths[1]}');"
-    sqlcommand = sqltext(textual_sql)
-    QUEUE.put({'type': 'gui', 'select': sqlcommand})
-    while RESULTSQ.empty():
-        time.sleep(0.01)
-    # set a longer timeout, cause we're not handling it if it expires
-    queue_entry = RESULTSQ.get(True, 150)
-    rows = queue_entry['rows']
-    RESULTSQ.task_done()
-    existing_relateds = ['', '']
-    for row in rows:
-        which_one = paths.index(row[0])
-        other_one = which_one ^ 1
-        if row[1] is None:
-            new_related = [paths[other_one], ]
-        else:
-            # filter through set to eliminate duplicates
-            new_related = list(set(row[1].split(',') + [paths[other_one],]))
-        textual_sql = f"UPDATE items set related = '{','.join(new_related)}' WHERE path = '{row[0]}';"
-        sqlcommand = sqltext(textual_sql)
-        QUEUE.put({'type': 'gui', 'select': sqlcommand})
-        while RESULTSQ.empty():
-            time.sleep(0.01)
-        # set a longer timeout, cause we're not handling it if it expires
-        queue_entry = RESULTSQ.get(True, 150)
-        RESULTSQ.task_done()
+    results = page_search_results()
+    paths = (results.paths[indicies[0]], results.paths[indicies[1]])
+
+    def edit(conn):
+        textual_sql = f"SELECT path, related from items WHERE path in ('{paths[0]}', '{paths[1]}');"
+        rows = conn.execute(sqltext(textual_sql)).fetchall()
+        for row in rows:
+            which_one = paths.index(row[0])
+            other_one = which_one ^ 1
+            if row[1] is None:
+                new_related = [paths[other_one], ]
+            else:
+                # filter through set to eliminate duplicates
+                new_related = list(set(row[1].split(',') + [paths[other_one],]))
+            textual_sql = f"UPDATE items set related = '{','.join(new_related)}' WHERE path = '{row[0]}';"
+            conn.execute(sqltext(textual_sql))
 
+    db_edit(edit)
     return 'relationship established'
 
 
+@bottle_route('/scan_status')
+def scan_status():
+    """progress of the initial scan, as JSON"""
+    status = dict(GLOBAL_DATA.scan_status)
+    if 'counts' in status:
+        status['counts'] = dict(status['counts'])
+    if 'started' in status:
+        status['elapsed'] = round(status.get('finished', time.time()) - status['started'], 1)
+    bottle_response.content_type = 'application/json'
+    return json.dumps(status)
+
+
 # Routes related to New indicator
 
 def check_new_table():
     textual_sql = "SELECT 1 from new;"
     sqlcommand = sqltext(textual_sql)
-    QUEUE.put({'type': 'gui', 'select': sqlcommand})
-    while RESULTSQ.empty():
-        time.sleep(0.01)
-    # set a longer timeout, cause we're not handling it if it expires
-    queue_entry = RESULTSQ.get(True, 150)
+    queue_entry = db_read(sqlcommand)
     rows = queue_entry['rows']
-    RESULTSQ.task_done()
     if len(rows) > 0:
         return True
     else:
@@ -1728,15 +3224,10 @@ def reset_new():
 def remove_new():
     """Remove the selected path (via item id) from the new table"""
     item_id = int(bottle_request.query.item_id)
-    path = GLOBAL_DATA.search_results_map[item_id]
+    path = page_search_results().paths[item_id]
     textual_sql = f"DELETE FROM new WHERE ( path = '{path}' );"
     sqlcommand = sqltext(textual_sql)
-    QUEUE.put({'type': 'gui', 'select': sqlcommand})
-    while RESULTSQ.empty():
-        time.sleep(0.01)
-    # set a longer timeout, cause we're not handling it if it expires
-    queue_entry = RESULTSQ.get(True, 150)
-    RESULTSQ.task_done()
+    db_edit(lambda conn: conn.execute(sqlcommand).close())
     # did we happen to remove the last new item? If so, shut off the lights
     if not check_new_table():
         GLOBAL_DATA.New = False
@@ -1785,10 +3276,17 @@ def serve_static(path):
 @bottle_route('/thumbnails/<path:path>')
 def serve_thumb(path):
     """
-    General service of thumbnail image file paths
+    General service of thumbnail image file paths. ?size=N picks the smallest stored size
+    at least N pixels, scaled from the full size preview if not done yet.
     """
     try:
         LOG.info('serving thumbnail %s', path)
+        size = bottle_request.query.get('size')
+        if size and '..' not in Path(path).parts:
+            size = int(size)
+            size = min([stored for stored in THUMBNAIL_SIZES if stored >= size],
+                       default=max(THUMBNAIL_SIZES))
+            path = sized_thumb(path, size)
         return static_file(path, root=str(THUMBNAIL_DIRECTORY))
     except Exception as exception_info:
         LOG.info('Exception in serving static_file(): ')
@@ -1797,6 +3295,38 @@ def serve_thumb(path):
         return "error"
 
 
+@bottle_route('/search_thumbnails')
+def serve_search_thumbnails():
+    """
+    All the previews for a page of search results in one response, rather than a request
+    per image - ?search=<id> from the page, see SearchResults. The body is packed as: 4 byte
+    big-endian length of a JSON index, the index - a list of [item_counter, byte length,
+    mime type] - then the images back to back in index order. ?size=N as for /thumbnails.
+    """
+    try:
+        size = int(bottle_request.query.get('size') or THUMBNAIL_DEFAULT_SIZE)
+    except ValueError:
+        size = THUMBNAIL_DEFAULT_SIZE  # not a number, the page gets the usual size
+    size = min([stored for stored in THUMBNAIL_SIZES if stored >= size],
+               default=max(THUMBNAIL_SIZES))
+    mime_types = {'.webp': 'image/webp', '.jpeg': 'image/jpeg'}
+    index = list()
+    images = list()
+    results = search_results(bottle_request.query.get('search'))
+    for item_counter, thumb in results.thumbs if results else list():
+        thumb_file = THUMBNAIL_DIRECTORY.joinpath(sized_thumb(thumb, size))
+        try:
+            image = thumb_file.read_bytes()
+        except OSError:
+            continue  # went away since the search, the page keeps its placeholder
+        index.append([item_counter, len(image), mime_types.get(thumb_file.suffix, 'image/jpeg')])
+        images.append(image)
+    LOG.info('serving %d search result thumbnails', len(index))
+    index_bytes = json.dumps(index).encode()
+    bottle_response.content_type = 'application/octet-stream'
+    return b''.join([struct.pack('>I', len(index_bytes)), index_bytes] + images)
+
+
 @bottle_route('/')
 def handle_home_path():
     """routing for / is to static_files/html/home.html """
@@ -1822,13 +3352,22 @@ def favicon():
     #     return f'you entered a url of /name/${name}'
 
 
+class ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+    """
+    bottle's default (wsgiref) server, handling each request in its own thread. Requests
+    share no search state - each names its page's search, see SearchResults.
+    """
+    daemon_threads = True
+
+
 def run_ui():
     """
     Start up the bottle server - running this entire function in a
     separate thread.
     """
     LOG.info(f'Running bottle UI in thread {threading.get_ident()}')
-    bottle_run(host='0.0.0.0', port=NETWORK_PORT, debug=True)
+    # a thread per request, so a slow search doesn't hold up the rest of the page
+    bottle_run(host='0.0.0.0', port=NETWORK_PORT, debug=True, server_class=ThreadingWSGIServer)
 
 
 def main():
@@ -1839,6 +3378,16 @@ def main():
     parser = argparse.ArgumentParser()
     parser.add_argument('--clear', dest='clear', action='store_true',
                         help='wipe any existing data and recreate')
+    parser.add_argument('--hash-workers', dest='hash_workers', type=int, default=HASH_WORKERS,
+                        help='number of workers hashing files during the initial scan, '
+                             '0 to hash on the main thread (default: one per CPU)')
+    parser.add_argument('--hash-pool', dest='hash_pool', choices=['process', 'thread'],
+                        default=HASH_POOL_TYPE,
+                        help='kind of worker pool used for hashing during the initial scan')
+    parser.add_argument('--verify', dest='verify', action='store_true',
+                        help='rehash every file during the initial scan, even ones that look unchanged')
+    parser.add_argument('--batch-size', dest='batch_size', type=int, default=INGEST_BATCH_SIZE,
+                        help='number of files committed per transaction during the initial scan')
     args = parser.parse_args()
 
     # pre-run cleanup
@@ -1852,12 +3401,19 @@ def main():
     # Set up lots of stuff
     GLOBAL_DATA = GlobalData()
 
-    # initially, scan the whole directory to rationalize any changes
-    initial_file_scan()
-
-    # run the web UI in other process
+    # run the web UI in other process - straight away, searches are answered while the
+    # initial scan runs (see /scan_status for its progress)
     threading.Thread(group=None, target=run_ui, name="run_ui").start()
-    time.sleep(0.5)  # let web server spin up, then open 'home' page
+
+    # previews are made in the background, starting with any a previous run left pending
+    os.chdir(ROOT_DIRECTORY)
+    GLOBAL_DATA.previews.start()
+    request_pending_previews()
+    # and the full hashes of items the scan takes as moved on their fingerprint
+    GLOBAL_DATA.verifier.start()
+
+    # initially, scan the whole directory to rationalize any changes
+    initial_file_scan(args.hash_workers, args.hash_pool, args.verify, args.batch_size)
     # try:
     #     web = webbrowser.open_new_tab(f'http://localhost:{NETWORK_PORT}/')
     #     LOG.info(f'webbrowser returns {web}')
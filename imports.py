@@ -2,15 +2,22 @@ import os
 import sys
 import time
 import json
+import signal
+import struct
 import queue
+import sqlite3
+import heapq
 import random
+import itertools
 import shutil
 import logging
 import argparse
 import datetime
 import threading
 import subprocess
+import multiprocessing
 import webbrowser
+import concurrent.futures
 
 # About making use of pathlib, instead of os.path and some others.
 # Mostly, paths stay Path objects unless a string is required, such as:
@@ -19,21 +26,31 @@ import webbrowser
 # file referenced by the Path object.
 from pathlib import Path
 
+from collections import namedtuple, defaultdict, OrderedDict
+
 from hashlib import sha512  # get sha 512 bit hash with sha512(string)
 from shutil import rmtree
 from tempfile import TemporaryFile
+from socketserver import ThreadingMixIn
+from wsgiref.simple_server import WSGIServer
+try:
+    import resource  # not on Windows - preview worker memory limits are skipped there
+except ImportError:
+    resource = None
 
 import bible
 
 # needed setup: pip3.6 install preview_generator, watchdog and sqlalchemy
-from preview_generator.manager import PreviewManager
+# preview_generator and PIL are imported where they're used, they're slow to load
 from watchdog.observers import Observer
 from watchdog.events import FileSystemEventHandler
-from sqlalchemy import create_engine, Table, Column, String, MetaData
+from sqlalchemy import create_engine, Table, Column, String, Integer, MetaData, Index
+from sqlalchemy.pool import QueuePool
 from sqlalchemy import select as sqlselect, text as sqltext,  \
-    update as sqlupdate, insert as sqlinsert
+    update as sqlupdate, insert as sqlinsert, bindparam, func as sqlfunc, \
+    literal as sqlliteral, and_ as sqland
 from bottle import route as bottle_route, run as bottle_run,  \
-    static_file, request as bottle_request
-# could include:  template,, response as bottle_response
+    static_file, request as bottle_request, response as bottle_response, abort as bottle_abort
+# could include:  template,
 # noinspection PyPep8,Pylint
 from bottle import debug as bottle_debug
@@ -120,6 +120,36 @@ function search_callback(data) {
     main.empty()
     main.append(data);
     $('.bigpath').single_double_click(single_click_callback, double_click_callback);
+    load_search_thumbnails();
+}
+
+// The previews for all the search results come in one response from /search_thumbnails:
+// a 4 byte length, a JSON index of [item_counter, byte length, mime type], then the images.
+// The request names the search this page shows, so it can't get some other search's previews.
+var search_thumbnail_urls = [];
+
+// Requests about the items on the page say which search put them there, see SearchResults
+function search_param() {
+    return 'search=' + jQuery('#search-results').data('search');
+}
+
+function load_search_thumbnails() {
+    search_thumbnail_urls.forEach(url => URL.revokeObjectURL(url));
+    search_thumbnail_urls = [];
+    fetch('/search_thumbnails?' + search_param())
+        .then(response => response.arrayBuffer())
+        .then(function(buffer) {
+            const index_length = new DataView(buffer).getUint32(0);
+            const index = JSON.parse(new TextDecoder().decode(new Uint8Array(buffer, 4, index_length)));
+            var offset = 4 + index_length;
+            for (const [item_counter, length, mime_type] of index) {
+                const image = new Blob([new Uint8Array(buffer, offset, length)], {type: mime_type});
+                const url = URL.createObjectURL(image);
+                search_thumbnail_urls.push(url);
+                jQuery(`#thumb-${item_counter}`).attr('src', url);
+                offset += length;
+            }
+        });
 }
 
 function do_main_search(new_search=false) {
@@ -178,7 +208,7 @@ function finish_add_a_label() {
     add_labels_modal.modal('toggle');
     const newlabels = add_a_label_input[0].value.toLowerCase();
     add_a_label_input[0].value = '';  // clear it for next time
-    jQuery.get('/add_label?item_id=' + active_item_id + ';labels=' + newlabels);
+    jQuery.get('/add_label?item_id=' + active_item_id + ';labels=' + newlabels + '&' + search_param());
     // add to search results
     const labels_span_id = `#labels-for-${active_item_id}`;
     const labels_span = $(labels_span_id);
@@ -205,6 +235,13 @@ function cancel_add_a_label() {
 }
 
 function remove_a_label(label_id) {
+    remove_label_from_page(label_id);
+    // remove from database
+    jQuery.get('/remove_label?id=' + label_id + '&' + search_param());
+    refresh_labels();
+}
+
+function remove_label_from_page(label_id) {
     // remove from GUI
     const idselector = "#" + label_id;
     $(idselector).remove();
@@ -225,9 +262,6 @@ function remove_a_label(label_id) {
             }
         }
     }
-    // remove from database
-    jQuery.get('/remove_label?id=' + label_id);
-    refresh_labels();
 }
 
 // Bulk selection and operations ---------------------------------------------------------------------------
@@ -343,7 +377,7 @@ function finish_bulk_action() {
        if (marked.length != 2) {
            alert('You need to select just two items to Relate them');
        } else {
-           var url = `/relate?items=${marked[0]},${marked[1]}`;
+           var url = `/relate?items=${marked[0]},${marked[1]}&` + search_param();
            jQuery.get(url); // tell the backend
            // now try updating the GUI...
            var paths = new Array();
@@ -388,8 +422,13 @@ function finish_bulk_action() {
         }
 
 
+        // one request for all the marked items, so the database commits them together
+        var bulk_action = $('#bulk-radio-add')[0].checked ? 'add' : 'remove';
+        var request = jQuery.get('/bulk_labels?action=' + bulk_action + '&items=' + marked.join(',')
+                   + '&labels=' + new_labels + '&' + search_param());
+
         // if adding new labels
-        if ( $('#bulk-radio-add')[0].checked ) {
+        if (bulk_action == 'add') {
 
             for (marked_item of marked) {
                 var copy_new_labels = new_labels.slice();
@@ -404,8 +443,6 @@ function finish_bulk_action() {
                         copy_new_labels.splice(i, 1);
                     }
                 }
-                // store new labels in the database
-                jQuery.get('/add_label?item_id=' + marked_item + ';labels=' + copy_new_labels);
 
                 // add new labels to search results
                 var labels_span_id = `#labels-for-${marked_item}`;
@@ -444,9 +481,11 @@ function finish_bulk_action() {
 
                 copy_new_labels.forEach(function(label) {
                     var label_key = `search-${marked_item}-${label}`;
-                    remove_a_label(label_key);
+                    remove_label_from_page(label_key);
                 })
             }
+            // labels no item has any more are gone once the request is done
+            request.done(function() { refresh_labels(); });
         }
     }
 
@@ -509,7 +548,8 @@ function finish_add_a_bibleref() {
     add_biblerefs_modal.modal('toggle');
     const new_biblerefs = add_a_bibleref_input[0].value;
     add_a_bibleref_input[0].value = '';  // clear it for next time
-    var get_response = jQuery.get('/add_bibleref?item_id=' + active_item_id + ';biblerefs=' + new_biblerefs);
+    var get_response = jQuery.get('/add_bibleref?item_id=' + active_item_id + ';biblerefs=' + new_biblerefs
+                                  + '&' + search_param());
     console.log('response from /add_bibleref?item_id: ' + get_response);
 
     // add to search results
@@ -566,7 +606,7 @@ function remove_a_bibleref(bibleref_id) {
         }
     }
     // remove from database
-    jQuery.get('/remove_bibleref?id=' + bibleref_id);
+    jQuery.get('/remove_bibleref?id=' + bibleref_id + '&' + search_param());
 }
 
 
@@ -686,7 +726,7 @@ function double_click_callback(item_id, item_path) {
 function confirm_new_remove(item_id) {
     var path = $(`.path-${item_id}`)[0].textContent;
     if (confirm(`Remove ${path} from new list?`)) {
-        jQuery.get(`/new-remove?item_id=${item_id}`);
+        jQuery.get(`/new-remove?item_id=${item_id}&` + search_param());
     }
     // remove from GUI
     $(`#new-indicator-${item_id}`)[0].remove();
@@ -734,6 +774,25 @@ function update_new_indicator() {
 }
 
 
+// ---------- Initial scan progress, shown until the scan completes --------------------
+
+function update_scan_status() {
+    jQuery.getJSON('/scan_status', function(status) {
+        const scan_status = $('#scan-status');
+        if (status.state == 'scanning') {
+            scan_status.text(`scanning: ${status.files} files, ${status.elapsed}s`);
+            setTimeout(update_scan_status, 2000);
+        } else if (status.state == 'waiting') {
+            setTimeout(update_scan_status, 2000);
+        } else {
+            scan_status.text('');
+        }
+    });
+}
+
+update_scan_status();
+
+
 function periodic_tasks() {
     update_new_indicator();
 }
@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# ddms is run as a script from the repository root, make it importable the same way
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
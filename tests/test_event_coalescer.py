@@ -0,0 +1,30 @@
+import os
+
+import ddms
+
+
+def storm(coalescer, directory):
+    """send enough events below directory to put it in a storm"""
+    for number in range(ddms.STORM_EVENTS + 1):
+        coalescer.event('add', os.path.join(directory, f'file-{number}'))
+    assert directory in coalescer.storms
+
+
+def test_storm_directory_renamed_before_its_rescan(monkeypatch):
+    monkeypatch.setattr(ddms, 'STORM_EVENTS', 5)
+    coalescer = ddms.EventCoalescer()
+    old = os.path.join('d', 'e')
+    new = os.path.join('d', 'g')
+    storm(coalescer, old)
+
+    coalescer.event('dir-moved', old, new)
+    # the rescan follows the directory
+    assert coalescer.storms == {new}
+    assert old not in coalescer.pending
+    assert coalescer.pending[new].action == 'rescan'
+
+    # and later events there, in the next storm window, just hold it back
+    coalescer.window_start -= ddms.STORM_WINDOW + 1
+    coalescer.event('add', os.path.join(new, 'new'))
+    assert list(coalescer.pending) == [new]
+    assert coalescer.directory_changes == [('dir-moved', old, new)]
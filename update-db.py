@@ -113,6 +113,139 @@ def main():
         stmp_db_version(version+1)
 
     elif version == 2:
+        make_backup()
+        # stat values recorded when a file was hashed, so unchanged files need not be reread
+        for column in ('size', 'mtime_ns', 'inode'):
+            textual_sql = f"ALTER TABLE items ADD '{column}' integer;"
+            sqlcommand = make_query(textual_sql)
+            results = db_conn.execute(sqlcommand)
+            if results.rowcount != -1:
+                print('could not alter table items')
+                sys.exit(1)
+
+        stmp_db_version(version+1)
+
+    elif version == 3:
+        make_backup()
+        # cheap size + first/last block fingerprint, filled in by the next scan
+        textual_sql = "ALTER TABLE items ADD 'fingerprint' string;"
+        sqlcommand = make_query(textual_sql)
+        results = db_conn.execute(sqlcommand)
+        if results.rowcount != -1:
+            print('could not alter table items')
+            sys.exit(1)
+        textual_sql = "CREATE INDEX ix_items_fingerprint ON items (fingerprint);"
+        db_conn.execute(make_query(textual_sql))
+
+        stmp_db_version(version+1)
+
+    elif version == 4:
+        make_backup()
+        # previews are now made in the background, this tracks where each one is at
+        textual_sql = "ALTER TABLE items ADD 'thumb_state' string;"
+        sqlcommand = make_query(textual_sql)
+        results = db_conn.execute(sqlcommand)
+        if results.rowcount != -1:
+            print('could not alter table items')
+            sys.exit(1)
+        textual_sql = "UPDATE items SET thumb_state = " \
+                      "CASE WHEN thumb IS NULL THEN 'failed' ELSE 'done' END;"
+        db_conn.execute(make_query(textual_sql))
+
+        stmp_db_version(version+1)
+
+    elif version == 5:
+        make_backup()
+        # previews are shared by content now, and counting an item's references needs this
+        textual_sql = "CREATE INDEX ix_items_thumb ON items (thumb);"
+        db_conn.execute(make_query(textual_sql))
+
+        stmp_db_version(version+1)
+
+    elif version == 6:
+        make_backup()
+        # labels move out of the comma separated items.labels column into an item_labels
+        # table, which needs integer ids on items and labels - so both tables are rebuilt
+        textual_sql = "SELECT name FROM sqlite_master WHERE type = 'index' " \
+                      "AND tbl_name IN ('items', 'labels') AND sql IS NOT NULL;"
+        old_indexes = [row[0] for row in db_conn.execute(make_query(textual_sql))]
+        with db_conn.begin():
+            # the new tables' indexes get the old names
+            for index_name in old_indexes:
+                db_conn.execute(make_query(f"DROP INDEX {index_name};"))
+            db_conn.execute(make_query("ALTER TABLE items RENAME TO items_old;"))
+            db_conn.execute(make_query("ALTER TABLE labels RENAME TO labels_old;"))
+
+            Table('items', metadata,
+                  Column('id', Integer, primary_key=True),
+                  Column('dir', String, index=True),
+                  Column('path', String, unique=True, index=True),
+                  Column('shahash', String, index=True),
+                  Column('thumb', String, index=True),
+                  Column('bibleref', String, index=True),
+                  Column('related', String),
+                  Column('date_created', String),
+                  Column('size', Integer),
+                  Column('mtime_ns', Integer),
+                  Column('inode', Integer),
+                  Column('fingerprint', String, index=True),
+                  Column('thumb_state', String))
+            Table('labels', metadata,
+                  Column('id', Integer, primary_key=True),
+                  Column('label', String, unique=True, index=True))
+            Table('item_labels', metadata,
+                  Column('label_id', Integer, primary_key=True),
+                  Column('item_id', Integer, primary_key=True),
+                  Index('ix_item_labels_item_id', 'item_id', 'label_id'),
+                  sqlite_with_rowid=False)
+            metadata.create_all(db_conn)  # on this connection, inside the transaction
+
+            columns = 'dir, path, shahash, thumb, bibleref, related, date_created, ' \
+                      'size, mtime_ns, inode, fingerprint, thumb_state'
+            textual_sql = f"INSERT INTO items ({columns}) SELECT {columns} FROM items_old;"
+            db_conn.execute(make_query(textual_sql))
+
+            # every label in use, plus the ones the labels table knew about
+            textual_sql = "SELECT items.id, items_old.labels FROM items JOIN items_old " \
+                          "ON items.path = items_old.path WHERE items_old.labels != '';"
+            item_labels = [(row[0], {label for label in row[1].split(',') if label})
+                           for row in db_conn.execute(make_query(textual_sql))]
+            all_labels = {row[0] for row in db_conn.execute(make_query(
+                "SELECT label FROM labels_old WHERE label != '';"))}
+            for _, labels in item_labels:
+                all_labels.update(labels)
+            if all_labels:
+                db_conn.execute(make_query("INSERT INTO labels(label) VALUES (:label);"),
+                                [{'label': label} for label in sorted(all_labels)])
+            label_ids = {row[1]: row[0] for row in db_conn.execute(
+                make_query("SELECT id, label FROM labels;"))}
+            rows = [{'label_id': label_ids[label], 'item_id': item_id}
+                    for item_id, labels in item_labels for label in labels]
+            if rows:
+                db_conn.execute(make_query("INSERT INTO item_labels(label_id, item_id) "
+                                           "VALUES (:label_id, :item_id);"), rows)
+
+            db_conn.execute(make_query("DROP TABLE items_old;"))
+            db_conn.execute(make_query("DROP TABLE labels_old;"))
+            # an item's labels go with it, same trigger as ddms.py makes
+            textual_sql = "CREATE TRIGGER IF NOT EXISTS item_labels_delete AFTER DELETE ON items " \
+                          "BEGIN DELETE FROM item_labels WHERE item_id = old.id; END;"
+            db_conn.execute(make_query(textual_sql))
+            print(f'moved {len(rows)} labels of {len(item_labels)} items to item_labels')
+
+            stmp_db_version(version+1)
+
+    elif version == 7:
+        make_backup()
+        # the dir column is kept with / separators on every platform now, so the searches
+        # can look directories up in its index. Only Windows ever stored anything else.
+        if os.sep != '/':
+            textual_sql = f"UPDATE items SET dir = replace(dir, '{os.sep}', '/');"
+            db_conn.execute(make_query(textual_sql))
+
+        stmp_db_version(version+1)
+
+    elif version == 8:
             # make_backup() in each section
             print('no additional database updates to apply')
             # stmp_db_version(version + 1)